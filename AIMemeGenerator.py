@@ -7,19 +7,27 @@ version = "1.0.5"
 
 # Import installed libraries
 import google.generativeai as genai
+from google.ai import generativelanguage as glm
 from stability_sdk import client
 import stability_sdk.interfaces.gooseai.generation.generation_pb2 as generation
+import stability_sdk.interfaces.gooseai.generation.generation_pb2_grpc as generation_grpc
+import grpc
 from PIL import Image, ImageDraw, ImageFont
 import requests
 
+# Import local modules
+from image_prompt_index import ImagePromptIndex
+from request_profiler import profile_call
+
 # Import standard libraries
 import warnings
 import re
 from base64 import b64decode
 from pkg_resources import parse_version
-from collections import namedtuple
+from collections import namedtuple, Counter
+from types import MappingProxyType
 import io
-from datetime import datetime
+from datetime import datetime, timedelta
 import glob
 import string
 import os
@@ -30,6 +38,15 @@ import configparser
 import platform
 import shutil
 import traceback
+import threading
+import time
+import functools
+import atexit
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+import json
+import csv
+import multiprocessing
+from multiprocessing import shared_memory
 
 # =============================================== Argument Parser ================================================
 # Parse the arguments at the start of the script
@@ -46,10 +63,25 @@ parser.add_argument("--imagespecialinstructions", help=f"The image special instr
 # These don't need to be specified as true/false, just specifying them will set them to true
 parser.add_argument("--nouserinput", action='store_true', help="Will prevent any user input prompts, and will instead use default values or other arguments.")
 parser.add_argument("--nofilesave", action='store_true', help="If specified, the meme will not be saved to a file, and only returned as virtual file part of memeResultsDictsList.")
+# Bulk mode
+parser.add_argument("--bulkfile", help="A JSONL or CSV file of prompts to generate memes for in one run. Each JSONL line (or CSV row) needs a 'prompt' and can have an 'id'. Implies --nouserinput.")
+parser.add_argument("--bulkmanifest", help="The JSONL manifest that bulk mode writes results to and resumes from. If not specified, the default is 'bulk_manifest.jsonl' in the output folder.")
+parser.add_argument("--bulkconcurrency", help="The number of memes bulk mode generates at the same time. If not specified, the default is 4.")
+# Profiling
+parser.add_argument("--profile", action='store_true', help="Profiles the run and saves a .pstats and a flamegraph-ready .collapsed file to the Profiles_Folder set in settings.ini (default 'Profiles').")
 args = parser.parse_args()
 
 # Create a namedtuple classes
-ApiKeysTupleClass = namedtuple('ApiKeysTupleClass', ['gemini_key', 'clipdrop_key', 'stability_key'])
+# gemini_key and clipdrop_key are the first key of each provider, and gemini_keys and clipdrop_keys hold all of them when there is a pool of keys
+ApiKeysTupleClass = namedtuple('ApiKeysTupleClass', ['gemini_key', 'clipdrop_key', 'stability_key', 'gemini_keys', 'clipdrop_keys'], defaults=((), ()))
+# Everything that is set up once by generate() and then shared by every meme it creates
+PipelineTupleClass = namedtuple('PipelineTupleClass', ['apiKeys', 'text_model', 'temperature', 'conversation', 'image_platform', 'model', 'stability_api', 'font_file', 'base_file_name', 'output_folder', 'basic_instructions', 'image_special_instructions', 'noFileSave', 'render_pool', 'secondary_image_platform', 'hedge_delay', 'prompt_index', 'image_reuse_threshold', 'image_request_timeout'])
+
+# Image platforms that can be used for generating the meme image
+VALID_IMAGE_PLATFORMS = ["stability", "clipdrop"]
+
+# Guards the output folder file counter and the log file when several memes are generated at once
+_output_files_lock = threading.Lock()
 
 # Create custom exceptions
 class NoFontFileError(Exception):
@@ -91,6 +123,33 @@ class InvalidImagePlatformError(Exception):
         self.valid_platforms = valid_platforms
         self.simple_message = message
 
+class RateLimitQuotaExceededError(Exception):
+    def __init__(self, message, provider, daily_quota):
+        full_error_message = f"The daily quota of {daily_quota} requests for {provider} has been used up. Raise or remove the '{provider}_Daily_Quota' setting in settings.ini, or try again tomorrow."
+        
+        super().__init__(full_error_message)
+        self.provider = provider
+        self.daily_quota = daily_quota
+        self.simple_message = message
+
+class TextGenerationError(Exception):
+    def __init__(self, message, provider, error_class):
+        full_error_message = f"{provider} could not write the meme text ({error_class}). {message}"
+        
+        super().__init__(full_error_message)
+        self.provider = provider
+        self.error_class = error_class
+        self.simple_message = message
+
+class CircuitOpenError(Exception):
+    def __init__(self, message, provider, retry_in):
+        full_error_message = f"Requests to {provider} are paused after repeated failures. Trying again in {retry_in:.0f} seconds."
+        
+        super().__init__(full_error_message)
+        self.provider = provider
+        self.retry_in = retry_in
+        self.simple_message = message
+
 # ==============================================================================================
 
 # Construct the system prompt for the chat bot
@@ -178,8 +237,9 @@ def get_config(config_file_path):
             # Remove quotes from string values
             settingValue = settingValue.strip("\"").strip("\'")
             # Check if it is boolean
-            if type(parseBool(settingValue, silent=True)) == bool:
-                settingValue = parseBool(settingValue)
+            parsedValue = parseBool(settingValue, silent=True)
+            if type(parsedValue) == bool:
+                settingValue = parsedValue
             config[key] = settingValue  # Do not use parseConfigSetting() here or else it will convert all values to lowercase
 
     return config
@@ -190,30 +250,132 @@ def get_assets_file(fileName):
     return os.path.join(os.path.abspath("assets"), fileName) # If running as script, specifies resource folder as /assets
 
 
-def get_settings(settings_filename="settings.ini"):
+# Checks setting values that would otherwise only fail partway through generating a meme. Returns a dictionary of error messages by setting name
+def validate_settings(settings):
+    errors = {}
+
+    def check_number(key, number_type, minimum=None, maximum=None):
+        if key not in settings:
+            return
+        try:
+            value = number_type(settings[key])
+        except (TypeError, ValueError):
+            errors[key] = f"{key} must be a number, got '{settings[key]}'"
+            return
+        if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+            errors[key] = f"{key} must be between {minimum} and {maximum if maximum is not None else 'any'}, got {value}"
+
+    check_number('Temperature', float, 0, 2)
+    check_number('Render_Workers', int, 0)
+    check_number('Coalesce_Fan_Out', int, 1)
+    check_number('Hedge_Delay', float, 0)
+    check_number('Stability_Deadline', float, 1)
+    check_number('Stability_Keepalive', float, 0)
+    check_number('ClipDrop_Timeout', float, 1)
+    check_number('Image_Reuse_Threshold', float, 0, 1)
+    check_number('Image_Reuse_Max_Entries', int, 0)
+    check_number('Image_Reuse_Max_Age_Days', float, 0)
+    check_number('Pregeneration_Hot_Topics', int, 0)
+    check_number('Pregeneration_Per_Topic', int, 0)
+    check_number('Pregeneration_Max_Age_Minutes', float, 0)
+    check_number('Pregeneration_Budget_Per_Hour', int, 0)
+    check_number('Profile_Sample_Interval_Ms', float, 0.1)
+    check_number('Key_Ejection_Seconds', float, 0)
+    check_number('Circuit_Failure_Threshold', int, 0)
+    check_number('Circuit_Reset_Seconds', float, 0)
+    check_number('Worker_Threads', int, 1)
+    check_number('Worker_Poll_Seconds', float, 0.01)
+    check_number('Job_Lease_Seconds', float, 1)
+    check_number('Job_Max_Attempts', int, 1)
+    check_number('Job_Wait_Seconds', float, 0)
+    check_number('Job_Stuck_Seconds', float, 1)
+    for provider_name in RATE_LIMITED_PROVIDERS.values():
+        check_number(f'{provider_name}_Requests_Per_Second', float, 0)
+        check_number(f'{provider_name}_Burst', int, 1)
+        check_number(f'{provider_name}_Daily_Quota', int, 0)
+
+    if 'Image_Platform' in settings and str(settings['Image_Platform']).lower() not in VALID_IMAGE_PLATFORMS:
+        errors['Image_Platform'] = f"Image_Platform must be one of {VALID_IMAGE_PLATFORMS}, got '{settings['Image_Platform']}'"
+    if 'Key_Selection' in settings and str(settings['Key_Selection']).lower() not in KEY_SELECTION_STRATEGIES:
+        errors['Key_Selection'] = f"Key_Selection must be one of {KEY_SELECTION_STRATEGIES}, got '{settings['Key_Selection']}'"
+    if settings.get('Secondary_Image_Platform') and str(settings['Secondary_Image_Platform']).lower() not in VALID_IMAGE_PLATFORMS:
+        errors['Secondary_Image_Platform'] = f"Secondary_Image_Platform must be empty or one of {VALID_IMAGE_PLATFORMS}, got '{settings['Secondary_Image_Platform']}'"
+    elif settings.get('Secondary_Image_Platform') and str(settings['Secondary_Image_Platform']).lower() == str(settings.get('Image_Platform', 'clipdrop')).lower():
+        errors['Secondary_Image_Platform'] = f"Secondary_Image_Platform must be a different platform than Image_Platform, got '{settings['Secondary_Image_Platform']}' for both"
+
+    return errors
+
+# Parsed settings snapshots, keyed by settings file name. Each holds the file's (mtime, size) when it was parsed
+_settings_snapshots = {}
+_settings_lock = threading.Lock()
+
+# Returns an immutable snapshot of the settings. The file is only parsed again when its modification time or size changes,
+# so edits to settings.ini take effect without a restart while every other call just costs one stat().
+# If the edited file fails validation, the errors are printed once and the previous snapshot stays in use. On the first load there is
+# no previous snapshot, so only the invalid settings are dropped and their built-in defaults are used.
+def get_settings(settings_filename="settings.ini", noUserInput=False):
     default_settings_filename = "settings_default.ini"
     def check_settings_file():
         if not os.path.isfile(settings_filename):
             file_to_copy_path = get_assets_file(default_settings_filename)
             shutil.copyfile(file_to_copy_path, settings_filename)
             print("\nINFO: Settings file not found, so default 'settings.ini' file created. You can use it going forward to change more advanced settings if you want.")
-            input("\nPress Enter to continue...")
-    
-    check_settings_file()
-    # Try to get settings file, if fails, use default settings
-    try:
-        settings = get_config(settings_filename)
-        pass
-    except:
-        settings = get_config(get_assets_file(default_settings_filename))
-        print("\nERROR: Could not read settings file. Using default settings instead.")
-        
-    # If something went wrong and empty settings, will use default settings
-    if settings == {}:
-        settings = get_config(get_assets_file(default_settings_filename))
-        print("\nERROR: Something went wrong reading the settings file. Using default settings instead.")
-        
-    return settings
+            if not noUserInput:
+                input("\nPress Enter to continue...")
+
+    def get_file_version():
+        try:
+            stat_result = os.stat(settings_filename)
+        except OSError:
+            return None
+        return (stat_result.st_mtime_ns, stat_result.st_size)
+
+    file_version = get_file_version()
+    # A deleted file has the version None, which is cached like any other so its errors are only reported once
+    cached = _settings_snapshots.get(settings_filename)
+    if cached is not None and cached[0] == file_version:
+        return cached[1]
+
+    with _settings_lock:
+        # Another thread may have reloaded it while we waited
+        cached = _settings_snapshots.get(settings_filename)
+        file_version = get_file_version()
+        if cached is not None and cached[0] == file_version:
+            return cached[1]
+
+        if cached is None:
+            check_settings_file()
+            file_version = get_file_version()
+
+        # Try to get settings file, if fails, use default settings
+        try:
+            settings = get_config(settings_filename)
+        except Exception as ex:
+            settings = {}
+            print(f"\nERROR: Could not read settings file. Error: {ex}")
+
+        errors = validate_settings(settings) if settings else {None: "The settings file is empty or could not be read."}
+        if errors:
+            print(f"\nERROR: Problems found in '{settings_filename}':")
+            for error in errors.values():
+                print(f"   - {error}")
+            if cached is not None:
+                print("Keeping the previous settings until the file is fixed.")
+                # Remember this file version so the same errors aren't reported on every call
+                _settings_snapshots[settings_filename] = (file_version, cached[1])
+                return cached[1]
+            if settings:
+                # The rest of the file is still used, only the invalid settings fall back to their defaults
+                print("Using the default values for these settings instead.")
+                settings = {key: value for key, value in settings.items() if key not in errors}
+            else:
+                # If something went wrong and there are no previous settings, will use default settings
+                print("Using default settings instead.")
+                settings = get_config(get_assets_file(default_settings_filename))
+
+        snapshot = MappingProxyType(settings)
+        _settings_snapshots[settings_filename] = (file_version, snapshot)
+        return snapshot
 
 # Get API key constants from config file or command line arguments
 def get_api_keys(api_key_filename="api_keys.ini", args=None):
@@ -238,15 +400,15 @@ def get_api_keys(api_key_filename="api_keys.ini", args=None):
     # Try to read keys from config file. Default value of '' will be used if not found
     try:
         keys_dict = get_config(api_key_filename)
-        # Get keys from the [Keys] section
+        # Get keys from the [Keys] section. Gemini and ClipDrop can have a comma separated list of keys
         gemini_key = keys_dict.get('Gemini', '')
         clipdrop_key = keys_dict.get('ClipDrop', '')
         stability_key = keys_dict.get('StabilityAI', '')
         
         # Print keys for debugging (masked)
         print("Loaded API Keys (masked):")
-        print(f"Gemini: {'*' * (len(gemini_key)-4) + gemini_key[-4:] if gemini_key else 'Not found'}")
-        print(f"ClipDrop: {'*' * (len(clipdrop_key)-4) + clipdrop_key[-4:] if clipdrop_key else 'Not found'}")
+        print(f"Gemini: {', '.join(mask_key(key) for key in parse_key_list(gemini_key)) or 'Not found'}")
+        print(f"ClipDrop: {', '.join(mask_key(key) for key in parse_key_list(clipdrop_key)) or 'Not found'}")
         
     except FileNotFoundError:
         print("Config not found, checking for command line arguments.")
@@ -257,31 +419,45 @@ def get_api_keys(api_key_filename="api_keys.ini", args=None):
         clipdrop_key = args.clipdropkey if args.clipdropkey else clipdrop_key
         stability_key = args.stabilitykey if args.stabilitykey else stability_key
 
-    return ApiKeysTupleClass(gemini_key, clipdrop_key, stability_key)
+    return make_api_keys(gemini_key, clipdrop_key, stability_key)
+
+# Splits a comma (or newline) separated list of keys, dropping duplicates
+def parse_key_list(keys):
+    return tuple(dict.fromkeys(key for key in re.split(r"[,\s]+", keys or '') if key))
+
+# Builds the API keys tuple. The Gemini and ClipDrop keys can each be one key or a comma separated list of keys
+def make_api_keys(gemini_key, clipdrop_key, stability_key):
+    gemini_keys = parse_key_list(gemini_key)
+    clipdrop_keys = parse_key_list(clipdrop_key)
+    return ApiKeysTupleClass(gemini_keys[0] if gemini_keys else '', clipdrop_keys[0] if clipdrop_keys else '', stability_key or '', gemini_keys, clipdrop_keys)
 
 # ------------ VALIDATION ------------
 
-def validate_api_keys(apiKeys, image_platform):
+def validate_api_keys(apiKeys, image_platform, secondary_image_platform=None):
     if not apiKeys.gemini_key:
         raise MissingGeminiKeyError("No Gemini API key found.")
 
-    valid_image_platforms = ["stability", "clipdrop"]
-    image_platform = image_platform.lower()
+    valid_image_platforms = VALID_IMAGE_PLATFORMS
 
-    if image_platform in valid_image_platforms:
-        if image_platform == "stability" and not apiKeys.stability_key:
-            raise MissingAPIKeyError("No Stability AI API key found.", "Stability AI")
+    # The secondary platform is optional, and is only checked if one is set
+    platforms_to_check = [image_platform]
+    if secondary_image_platform:
+        platforms_to_check.append(secondary_image_platform)
 
-        if image_platform == "clipdrop" and not apiKeys.clipdrop_key:
-            raise MissingAPIKeyError("No ClipDrop API key found.", "ClipDrop")
+    for platform_to_check in platforms_to_check:
+        platform_to_check = platform_to_check.lower()
 
-    else:
-        raise InvalidImagePlatformError(f'Invalid image platform provided.', image_platform, valid_image_platforms)
+        if platform_to_check in valid_image_platforms:
+            if platform_to_check == "stability" and not apiKeys.stability_key:
+                raise MissingAPIKeyError("No Stability AI API key found.", "Stability AI")
 
-def initialize_api_clients(apiKeys, image_platform):
-    # Configure Gemini API
-    genai.configure(api_key=apiKeys.gemini_key)
-    
+            if platform_to_check == "clipdrop" and not apiKeys.clipdrop_key:
+                raise MissingAPIKeyError("No ClipDrop API key found.", "ClipDrop")
+
+        else:
+            raise InvalidImagePlatformError(f'Invalid image platform provided.', platform_to_check, valid_image_platforms)
+
+def initialize_api_clients(apiKeys, image_platform, secondary_image_platform=None, stability_verbose=False, stability_deadline=120.0, stability_keepalive=300.0):
     # Set up the model configuration
     generation_config = {
         "temperature": 0.7,
@@ -310,29 +486,547 @@ def initialize_api_clients(apiKeys, image_platform):
         }
     ]
     
-    # Initialize the model with the specified model name and configuration
+    # Initialize the model with the specified model name and configuration, on the first key's client
     model = genai.GenerativeModel(
         model_name="gemini-1.5-pro-002",
         generation_config=generation_config,
         safety_settings=safety_settings
     )
+    model._client = get_gemini_client(apiKeys.gemini_key)
 
     # Initialize Stability API if needed
     stability_api = None
-    if apiKeys.stability_key and image_platform == "stability":
-        stability_api = client.StabilityInference(
-            key=apiKeys.stability_key,
-            verbose=True,
-            engine="stable-diffusion-xl-1024-v0-9",
-        )
+    if apiKeys.stability_key and "stability" in (image_platform, secondary_image_platform):
+        stability_api = get_stability_client(apiKeys.stability_key, stability_verbose, stability_deadline, stability_keepalive)
     
     return stability_api, model
 
+# ------------ GEMINI CLIENT ------------
+# One Gemini client per API key, instead of the process-wide key set by genai.configure(), so requests on different keys can run at the same time
+
+_gemini_clients = {}
+_gemini_clients_lock = threading.Lock()
+
+# Returns the shared Gemini client for the key, creating it on first use
+def get_gemini_client(gemini_key):
+    with _gemini_clients_lock:
+        gemini_client = _gemini_clients.get(gemini_key)
+        if gemini_client is None:
+            gemini_client = glm.GenerativeServiceClient(client_options={"api_key": gemini_key})
+            _gemini_clients[gemini_key] = gemini_client
+        return gemini_client
+
+# ------------ STABILITY CLIENT ------------
+# One long-lived Stability client per API key for the whole process. Its gRPC channel is a single HTTP/2 connection,
+# so concurrent generations from different threads run as multiplexed streams on it instead of each paying for connection setup.
+
+STABILITY_HOST = "grpc.stability.ai:443"
+STABILITY_ENGINE = "stable-diffusion-xl-1024-v0-9"
+
+_stability_clients = {}
+_stability_clients_lock = threading.Lock()
+
+# Opens the channel the Stability SDK would, plus keepalive pings while calls are running, so a dead connection is noticed.
+# gRPC servers answer pings more often than every 5 minutes with GOAWAY too_many_pings by default, so keepalive_seconds should stay at 300 or more. 0 turns pings off
+def open_stability_channel(stability_key, keepalive_seconds=300.0):
+    max_message_size = int(os.getenv("MAX_MESSAGE_SIZE", 10 * 1024 * 1024))
+    options = [
+        ("grpc.max_send_message_length", max_message_size),
+        ("grpc.max_receive_message_length", max_message_size),
+    ]
+    if keepalive_seconds > 0:
+        options += [
+            ("grpc.keepalive_time_ms", int(keepalive_seconds * 1000)),
+            ("grpc.keepalive_timeout_ms", 20000),
+        ]
+    channel_credentials = grpc.composite_channel_credentials(
+        grpc.ssl_channel_credentials(), grpc.access_token_call_credentials(stability_key)
+    )
+    return grpc.secure_channel(STABILITY_HOST, channel_credentials, options=options)
+
+# The SDK client on a channel passed in, since StabilityInference.__init__ can only open channels without keepalive.
+# The SDK constructor is given a plaintext placeholder host, whose channel never connects because gRPC channels connect on first use, and its stub is then replaced
+class StabilityClient(client.StabilityInference):
+    def __init__(self, channel, engine=STABILITY_ENGINE, verbose=False, deadline_seconds=120.0):
+        super().__init__(host="localhost", engine=engine, verbose=False, wait_for_ready=True)
+        self.verbose = verbose
+        self.channel = channel
+        self.stub = generation_grpc.GenerationServiceStub(channel)
+        # The SDK passes grpc_args on to every Generate call
+        self.grpc_args["timeout"] = deadline_seconds
+
+# Returns the shared Stability client for the key, creating it on first use. deadline_seconds limits each generation call.
+# A client is only shared while the deadline and keepalive stay the same. When they change, the key gets a new client, and the old one's channel closes once the calls still using it are done
+def get_stability_client(stability_key, verbose=False, deadline_seconds=120.0, keepalive_seconds=300.0):
+    channel_settings = (deadline_seconds, keepalive_seconds)
+    with _stability_clients_lock:
+        cached = _stability_clients.get(stability_key)
+        if cached is None or cached[0] != channel_settings:
+            stability_api = StabilityClient(open_stability_channel(stability_key, keepalive_seconds), verbose=verbose, deadline_seconds=deadline_seconds)
+            _stability_clients[stability_key] = (channel_settings, stability_api)
+        else:
+            stability_api = cached[1]
+            stability_api.verbose = verbose
+        return stability_api
+
+
+# =============================================== Rate Limiting ================================================
+# Every call to a provider API first takes a token from the bucket of the API key it uses. Calls over the rate wait their turn instead of failing with a 429,
+# so a batch runs at the provider's sustained maximum. The buckets are module level, so every generation path in the process shares them, including the Flask app.
+
+# Providers that have a rate limiter, and the prefix of their settings in the [Rate Limits] section of settings.ini
+RATE_LIMITED_PROVIDERS = {"gemini": "Gemini", "clipdrop": "ClipDrop", "stability": "Stability"}
+# How many times a request that still gets a 429 response is queued and retried before giving up
+RATE_LIMIT_RETRIES = 3
+
+class TokenBucketRateLimiter:
+    # A requests_per_second or daily_quota of 0 means no limit
+    def __init__(self, provider, requests_per_second=0, burst=1, daily_quota=0):
+        self.provider = provider
+        self._lock = threading.Lock()
+        self._tokens = float(max(burst, 1))
+        self._last_refill = time.monotonic()
+        # No request goes out before this time, set by backoff() when the limiter has no rate to push back
+        self._not_before = 0.0
+        self._quota_day = datetime.now().date()
+        self.used_today = 0
+        self.configure(requests_per_second, burst, daily_quota)
+
+    def configure(self, requests_per_second, burst, daily_quota):
+        with self._lock:
+            self.requests_per_second = float(requests_per_second)
+            self.burst = max(int(burst), 1)
+            self.daily_quota = int(daily_quota)
+            self._tokens = min(self._tokens, self.burst)
+
+    def _refill(self, now):
+        if self.requests_per_second > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.requests_per_second)
+        self._last_refill = now
+        today = datetime.now().date()
+        if today != self._quota_day:
+            self._quota_day = today
+            self.used_today = 0
+
+    # Takes a token, waiting as long as needed. Tokens are handed out in the order requests arrive, because each caller reserves its token before sleeping
+    def acquire(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.daily_quota and self.used_today >= self.daily_quota:
+                raise RateLimitQuotaExceededError(f"Daily quota for {self.provider} used up.", self.provider, self.daily_quota)
+            self.used_today += 1
+            now = time.monotonic()
+            if self.requests_per_second <= 0:
+                wait_time = max(self._not_before - now, 0.0)
+            else:
+                self._tokens -= 1
+                wait_time = -self._tokens / self.requests_per_second if self._tokens < 0 else 0.0
+        if wait_time > 0:
+            time.sleep(wait_time)
+        return wait_time
+
+    # Pushes the next free slot back, for when the provider says to slow down anyway (e.g. a 429 with a Retry-After header).
+    # Nothing sleeps here, the next acquire() waits instead
+    def backoff(self, seconds):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self.requests_per_second > 0:
+                self._tokens = min(self._tokens, 0.0) - seconds * self.requests_per_second
+            else:
+                self._not_before = max(self._not_before, now + seconds)
+
+    def quota_used_up(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return bool(self.daily_quota) and self.used_today >= self.daily_quota
+
+    # How long a request made now would have to wait for a token
+    def get_wait_time(self):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self.requests_per_second <= 0:
+                return max(self._not_before - now, 0.0)
+            if self._tokens >= 1:
+                return 0.0
+            return (1 - self._tokens) / self.requests_per_second
+
+# =============================================== API Key Pools ================================================
+# A provider can have several API keys (a comma separated list in api_keys.ini). Each key has its own rate limiter, so the [Rate Limits]
+# settings apply per key and throughput grows with the number of keys. Every request picks a key from the pool, either the least loaded one
+# (fewest requests in flight, then shortest wait for a token) or the next one in turn, depending on Key_Selection.
+# A key that gets a 429 or 403 is ejected from the pool for a while (its Retry-After, or Key_Ejection_Seconds) and the request is retried on another key.
+# A key that has used up its daily quota is skipped until the quota day rolls over, and only when every key has is RateLimitQuotaExceededError raised.
+
+KEY_SELECTION_STRATEGIES = ["least_loaded", "round_robin"]
+# Error classes that get a key ejected, see classify_provider_error()
+KEY_EJECTION_CLASSES = {"rate_limited", "auth"}
+
+# The state of one API key, shared by every pool that has the key
+class ApiKeyState:
+    def __init__(self, provider, key):
+        self.provider = provider
+        self.key = key
+        self.limiter = TokenBucketRateLimiter(f"{RATE_LIMITED_PROVIDERS[provider]} key {mask_key(key)}")
+        self.in_flight = 0
+        self.requests = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+def mask_key(key):
+    return "*" * 4 + key[-4:] if len(key) > 4 else "*" * len(key)
+
+# Seconds until midnight, when the daily quotas start over
+def seconds_until_quota_reset():
+    now = datetime.now()
+    return (datetime.combine(now.date() + timedelta(days=1), datetime.min.time()) - now).total_seconds()
+
+_api_key_states = {}
+_key_pools = {}
+_key_pools_lock = threading.Lock()
+# The [Rate Limits] settings, applied to keys as they are first used
+_key_pool_settings = {}
+
+def _configure_key_limiter(state):
+    provider_name = RATE_LIMITED_PROVIDERS[state.provider]
+    state.limiter.configure(
+        float(_key_pool_settings.get(f'{provider_name}_Requests_Per_Second', 0)),
+        int(_key_pool_settings.get(f'{provider_name}_Burst', 1)),
+        int(_key_pool_settings.get(f'{provider_name}_Daily_Quota', 0))
+    )
+
+class ApiKeyPool:
+    def __init__(self, provider, keys):
+        self.provider = provider
+        self.keys = keys
+        self._next = 0
+
+    # Must be called holding _key_pools_lock
+    def _states(self):
+        states = []
+        for key in self.keys:
+            state = _api_key_states.get((self.provider, key))
+            if state is None:
+                state = _api_key_states[(self.provider, key)] = ApiKeyState(self.provider, key)
+                _configure_key_limiter(state)
+            states.append(state)
+        return states
+
+    # The keys a request can use right now. Keys with no daily quota left are never used. If every other key is ejected,
+    # the one that comes back soonest is used anyway. Must be called holding _key_pools_lock
+    def _usable(self, states, now):
+        with_quota = [state for state in states if not state.limiter.quota_used_up()]
+        if not with_quota:
+            return []
+        return [state for state in with_quota if state.ejected_until <= now] or [min(with_quota, key=lambda state: state.ejected_until)]
+
+    def _quota_exceeded_error(self):
+        provider_name = RATE_LIMITED_PROVIDERS[self.provider]
+        daily_quota = int(_key_pool_settings.get(f'{provider_name}_Daily_Quota', 0))
+        return RateLimitQuotaExceededError(f"Daily quota for {provider_name} used up on every key.", provider_name, daily_quota)
+
+    # Picks the key for the next request and counts it as in flight. Raises RateLimitQuotaExceededError if every key's daily quota is used up
+    def _choose(self):
+        with _key_pools_lock:
+            now = time.monotonic()
+            states = self._states()
+            # Start from the next key in turn, so ties (and round robin) rotate through the keys
+            states = states[self._next:] + states[:self._next]
+            self._next = (self._next + 1) % len(states)
+            available = self._usable(states, now)
+            if not available:
+                raise self._quota_exceeded_error()
+            if str(_key_pool_settings.get('Key_Selection', 'least_loaded')).lower() == 'round_robin':
+                state = available[0]
+            else:
+                state = min(available, key=lambda state: (state.in_flight, state.limiter.get_wait_time()))
+            state.in_flight += 1
+            state.requests += 1
+            return state
+
+    def _has_available_key(self):
+        with _key_pools_lock:
+            now = time.monotonic()
+            return any(state.ejected_until <= now and not state.limiter.quota_used_up() for state in self._states())
+
+    def _eject(self, state, seconds):
+        with _key_pools_lock:
+            state.ejected_until = max(state.ejected_until, time.monotonic() + seconds)
+            state.ejections += 1
+        print(f"{RATE_LIMITED_PROVIDERS[self.provider]} key {mask_key(state.key)} taken out of use for {seconds:g} seconds.")
+
+    # Calls fn(key) with a key from the pool, waiting for the key's rate limit first. A 429 or 403 ejects the key and the call is retried on another one.
+    # If no other key is left, a 429 is retried on the same key after its Retry-After (1 second if it has none), and a 403 is raised.
+    # A key whose daily quota runs out is skipped from then on and the call moves to another key, without counting as a retry
+    def call(self, fn):
+        attempt = 0
+        while True:
+            state = self._choose()
+            try:
+                try:
+                    state.limiter.acquire()
+                except RateLimitQuotaExceededError:
+                    continue
+                return fn(state.key)
+            except Exception as ex:
+                error_class = classify_provider_error(ex)
+                if error_class not in KEY_EJECTION_CLASSES or attempt == RATE_LIMIT_RETRIES:
+                    raise
+                retry_after = get_retry_after(ex)
+                self._eject(state, retry_after if retry_after is not None else float(_key_pool_settings.get('Key_Ejection_Seconds', 60)))
+                if not self._has_available_key():
+                    if error_class != "rate_limited":
+                        raise
+                    print(f"{RATE_LIMITED_PROVIDERS[self.provider]} rate limit reached, waiting to retry...")
+                    state.limiter.backoff(retry_after if retry_after is not None else 1.0)
+                attempt += 1
+            finally:
+                with _key_pools_lock:
+                    state.in_flight -= 1
+
+    # How long a request made now would wait, on the key that is free soonest. Uses the same keys _choose() would,
+    # so an ejected key that would be used anyway only counts its rate limit. With every key's quota used up, it is the time until the quotas reset
+    def get_wait_time(self):
+        with _key_pools_lock:
+            now = time.monotonic()
+            states = self._usable(self._states(), now)
+        if not states:
+            return seconds_until_quota_reset()
+        return min(state.limiter.get_wait_time() for state in states)
+
+# Returns the pool for the provider's keys. Pools with the same keys share their key states
+def get_key_pool(provider, keys):
+    provider = provider.lower()
+    keys = tuple(keys)
+    with _key_pools_lock:
+        pool = _key_pools.get((provider, keys))
+        if pool is None:
+            pool = _key_pools[(provider, keys)] = ApiKeyPool(provider, keys)
+        return pool
+
+# The keys of the provider in the API keys tuple
+def get_provider_keys(apiKeys, provider):
+    provider = provider.lower()
+    if provider == "gemini":
+        return apiKeys.gemini_keys or (apiKeys.gemini_key,)
+    if provider == "clipdrop":
+        return apiKeys.clipdrop_keys or (apiKeys.clipdrop_key,)
+    return (apiKeys.stability_key,)
+
+# How long a request to the provider would wait right now, on its least busy key. 0 if no key of the provider has been used yet
+def get_provider_wait_time(provider):
+    provider = provider.lower()
+    with _key_pools_lock:
+        pools = [pool for (pool_provider, _), pool in _key_pools.items() if pool_provider == provider]
+    return min((pool.get_wait_time() for pool in pools), default=0.0)
+
+# Applies the [Rate Limits] settings to every key. Existing buckets are updated in place, so calling it again on every request keeps any queued waits intact
+def configure_rate_limits(settings):
+    with _key_pools_lock:
+        _key_pool_settings.clear()
+        _key_pool_settings.update(settings)
+        for state in _api_key_states.values():
+            _configure_key_limiter(state)
+
+# Returns the current wait time, quota usage and health of every key, by provider
+def get_rate_limit_status():
+    now = time.monotonic()
+    status = {provider: {"keys": []} for provider in RATE_LIMITED_PROVIDERS}
+    with _key_pools_lock:
+        states = list(_api_key_states.values())
+    for state in states:
+        status[state.provider]["keys"].append({
+            "key": mask_key(state.key),
+            "wait_time": state.limiter.get_wait_time(),
+            "requests_per_second": state.limiter.requests_per_second,
+            "used_today": state.limiter.used_today,
+            "daily_quota": state.limiter.daily_quota,
+            "in_flight": state.in_flight,
+            "requests": state.requests,
+            "ejections": state.ejections,
+            "ejected_for": max(state.ejected_until - now, 0.0)
+        })
+    for provider in status:
+        status[provider]["wait_time"] = get_provider_wait_time(provider)
+    return status
+
+# Gets the number of seconds to wait from a Retry-After header, which can be missing or an HTTP date instead of a number
+def parse_retry_after(response, default=1.0):
+    try:
+        return float(response.headers.get('Retry-After', default))
+    except ValueError:
+        return default
+
+# The Retry-After of the HTTP response an exception came with, or None if it has none
+def get_retry_after(ex):
+    headers = getattr(getattr(ex, 'response', None), 'headers', None)
+    if not headers or 'Retry-After' not in headers:
+        return None
+    return parse_retry_after(ex.response, None)
+
+# =============================================== Circuit Breakers ================================================
+# Each provider has a circuit breaker. After Circuit_Failure_Threshold failures in a row its circuit opens, and requests to it fail straight away
+# with CircuitOpenError instead of waiting on a provider that is down. After Circuit_Reset_Seconds one probe request is let through (half open):
+# if it succeeds the circuit closes again, if it fails the circuit stays open for another Circuit_Reset_Seconds.
+# Errors are classified first. Only errors that say something about the provider's health count as failures. A rejected prompt
+# means the provider is up, and a local daily quota error never reached it.
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+# Error classes that count towards opening the circuit
+CIRCUIT_FAILURE_CLASSES = {"server", "timeout", "connection", "auth", "rate_limited", "other"}
+# Error classes that show the provider answered normally
+CIRCUIT_RESPONSIVE_CLASSES = {"client", "blocked", "malformed"}
+
+GRPC_ERROR_CLASSES = {
+    grpc.StatusCode.DEADLINE_EXCEEDED: "timeout",
+    grpc.StatusCode.UNAVAILABLE: "connection",
+    grpc.StatusCode.RESOURCE_EXHAUSTED: "rate_limited",
+    grpc.StatusCode.UNAUTHENTICATED: "auth",
+    grpc.StatusCode.PERMISSION_DENIED: "auth",
+    grpc.StatusCode.INVALID_ARGUMENT: "client",
+    grpc.StatusCode.FAILED_PRECONDITION: "client",
+}
+
+# Sorts an exception from a provider call into an error class: quota, server, timeout, connection, auth, rate_limited, client, blocked, malformed or other
+def classify_provider_error(ex):
+    if isinstance(ex, RateLimitQuotaExceededError):
+        return "quota"
+    if isinstance(ex, TextGenerationError):
+        return ex.error_class
+    if isinstance(ex, (requests.Timeout, TimeoutError)):
+        return "timeout"
+    if isinstance(ex, (requests.ConnectionError, ConnectionError)):
+        return "connection"
+    if isinstance(ex, grpc.RpcError) and callable(getattr(ex, 'code', None)):
+        return GRPC_ERROR_CLASSES.get(ex.code(), "server")
+
+    # HTTP errors from requests carry the response, Google API errors carry the HTTP status as their code
+    status_code = getattr(getattr(ex, 'response', None), 'status_code', None)
+    if status_code is None and isinstance(getattr(ex, 'code', None), int):
+        status_code = ex.code
+    if status_code is not None:
+        if status_code == 429:
+            return "rate_limited"
+        if status_code in (401, 403):
+            return "auth"
+        if status_code in (408, 504):
+            return "timeout"
+        if status_code >= 500:
+            return "server"
+        if status_code >= 400:
+            return "client"
+    return "other"
+
+class CircuitBreaker:
+    # A failure_threshold of 0 turns the breaker off
+    def __init__(self, provider, failure_threshold=5, reset_timeout=30.0):
+        self.provider = provider
+        self._lock = threading.Lock()
+        self.state = CIRCUIT_CLOSED
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.times_opened = 0
+        self.rejected = 0
+        self.errors_by_class = Counter()
+        self.configure(failure_threshold, reset_timeout)
+
+    def configure(self, failure_threshold, reset_timeout):
+        with self._lock:
+            self.failure_threshold = int(failure_threshold)
+            self.reset_timeout = float(reset_timeout)
+
+    def _retry_in(self):
+        return max(self._opened_at + self.reset_timeout - time.monotonic(), 0.0)
+
+    # Raises CircuitOpenError if the request may not go to the provider right now
+    def before_call(self):
+        with self._lock:
+            if self.failure_threshold <= 0:
+                return
+            if self.state == CIRCUIT_OPEN:
+                retry_in = self._retry_in()
+                if retry_in > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(f"The {self.provider} circuit is open.", self.provider, retry_in)
+                self.state = CIRCUIT_HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == CIRCUIT_HALF_OPEN:
+                # Only one probe at a time. Everything else keeps failing fast until it answers
+                if self._probe_in_flight:
+                    self.rejected += 1
+                    raise CircuitOpenError(f"The {self.provider} circuit is being tested.", self.provider, 0.0)
+                self._probe_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = CIRCUIT_CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    # Classifies the error, updates the circuit, and returns the error class
+    def record_failure(self, ex):
+        error_class = classify_provider_error(ex)
+        with self._lock:
+            self.errors_by_class[error_class] += 1
+            self._probe_in_flight = False
+            if error_class in CIRCUIT_RESPONSIVE_CLASSES:
+                self.state = CIRCUIT_CLOSED
+                self.consecutive_failures = 0
+            elif error_class in CIRCUIT_FAILURE_CLASSES:
+                self.consecutive_failures += 1
+                if self.failure_threshold > 0 and (self.state == CIRCUIT_HALF_OPEN or self.consecutive_failures >= self.failure_threshold):
+                    if self.state != CIRCUIT_OPEN:
+                        self.times_opened += 1
+                        print(f"{self.provider} failed {self.consecutive_failures} times in a row, pausing requests to it for {self.reset_timeout:g} seconds.")
+                    self.state = CIRCUIT_OPEN
+                    self._opened_at = time.monotonic()
+        return error_class
+
+    def get_status(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "retry_in": self._retry_in() if self.state == CIRCUIT_OPEN else 0.0,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+                "errors_by_class": dict(self.errors_by_class)
+            }
+
+_circuit_breakers = {provider: CircuitBreaker(provider_name) for provider, provider_name in RATE_LIMITED_PROVIDERS.items()}
+
+def get_circuit_breaker(provider):
+    return _circuit_breakers[provider.lower()]
+
+# Applies the [Circuit Breaker] settings to every provider's breaker, keeping their current state
+def configure_circuit_breakers(settings):
+    for breaker in _circuit_breakers.values():
+        breaker.configure(int(settings.get('Circuit_Failure_Threshold', 5)), float(settings.get('Circuit_Reset_Seconds', 30)))
+
+def get_circuit_breaker_status():
+    return {provider: breaker.get_status() for provider, breaker in _circuit_breakers.items()}
+
+# Calls fn() through the provider's circuit breaker
+def call_with_circuit_breaker(provider, fn):
+    breaker = get_circuit_breaker(provider)
+    breaker.before_call()
+    try:
+        result = fn()
+    except Exception as ex:
+        breaker.record_failure(ex)
+        raise
+    breaker.record_success()
+    return result
 
 # =============================================== Functions ================================================
 
-# Sets the name and path of the file to be used
-def set_file_path(baseName, outputFolder):
+# Sets the name and path of the file to be used. If reserve is True, an empty placeholder file is created so concurrent generations never get the same file name
+def set_file_path(baseName, outputFolder, reserve=False):
     def get_next_counter():
         # Check existing files in the directory
         existing_files = glob.glob(os.path.join(outputFolder, baseName + "_" + timestamp + "_*.png"))
@@ -351,25 +1045,28 @@ def set_file_path(baseName, outputFolder):
     # Generate a timestamp string to append to the file name
     timestamp = datetime.now().strftime("%Y-%m-%d-%H-%M")
     
-    # If the output folder does not exist, create it
-    if not os.path.exists(outputFolder):
-        os.makedirs(outputFolder)
-    
-    # Get the next counter number
-    file_counter = get_next_counter()
+    with _output_files_lock:
+        # If the output folder does not exist, create it
+        if not os.path.exists(outputFolder):
+            os.makedirs(outputFolder)
+        
+        # Get the next counter number
+        file_counter = get_next_counter()
 
-    # Set the file name
-    fileName = baseName + "_" + timestamp + "_" + str(file_counter) + ".png"
-    filePath = os.path.join(outputFolder, fileName)
+        # Set the file name
+        fileName = baseName + "_" + timestamp + "_" + str(file_counter) + ".png"
+        filePath = os.path.join(outputFolder, fileName)
+
+        if reserve:
+            open(filePath, "a").close()
     
     return filePath, fileName
 
-    
 # Write or append log file containing the user user message, chat bot meme text, and chat bot image prompt for each meme
 def write_log_file(userPrompt, AiMemeDict, filePath, logFolder, basic, special, platform):
     # Get file name from path
     memeFileName = os.path.basename(filePath)
-    with open(os.path.join(logFolder, "log.txt"), "a", encoding='utf-8') as log_file:
+    with _output_files_lock, open(os.path.join(logFolder, "log.txt"), "a", encoding='utf-8') as log_file:
         log_file.write(textwrap.dedent(f"""
                        Meme File Name: {memeFileName}
                        AI Basic Instructions: {basic}
@@ -381,60 +1078,123 @@ def write_log_file(userPrompt, AiMemeDict, filePath, logFolder, basic, special,
                        \n"""))
         
         
-def check_for_update(currentVersion=version, updateReleaseChannel=None, silentCheck=False):
+# =============================================== Update Check ================================================
+# The latest release info from GitHub is cached on disk, so repeated launches within the TTL make no network call at all,
+# and interactive runs do the check on a background thread, so startup never waits on GitHub even when offline or rate limited.
+
+UPDATE_CHECK_CACHE_FILE = "update_check_cache.json"
+UPDATE_CHECK_TTL = 12 * 60 * 60         # Seconds to reuse a successful check
+UPDATE_CHECK_FAILURE_TTL = 60 * 60      # Seconds to reuse a failed check, such as a 403 rate limit or no connection
+UPDATE_CHECK_TIMEOUT = 5                # Seconds before giving up on GitHub
+
+# Returns the status code and release info (a dict for the stable channel, a list of the 10 newest for all) for the release channel, from the cache if fresh.
+# A connection failure is cached too, and raised again as a ConnectionError while its cache entry is fresh
+def fetch_release_info(updateReleaseChannel, cache_file=UPDATE_CHECK_CACHE_FILE):
+    channel = updateReleaseChannel.lower()
+    try:
+        with open(cache_file, "r", encoding='utf-8') as f:
+            cache = json.load(f)
+        ttl = UPDATE_CHECK_TTL if cache['status_code'] == 200 else UPDATE_CHECK_FAILURE_TTL
+        if cache['channel'] == channel and 0 <= time.time() - cache['checked_at'] < ttl:
+            cached_error = cache.get('error')
+        else:
+            cache = None
+    except (OSError, ValueError, KeyError, TypeError):
+        cache = None
+    if cache is not None:
+        if cached_error:
+            raise requests.ConnectionError(cached_error)
+        return cache['status_code'], cache['releases']
+
+    def write_cache(status_code, releases, error=None):
+        try:
+            with open(cache_file, "w", encoding='utf-8') as f:
+                json.dump({"channel": channel, "checked_at": time.time(), "status_code": status_code, "releases": releases, "error": error}, f)
+        except OSError:
+            pass
+
+    # requests' connection errors and timeouts are OSErrors
+    try:
+        if channel == "stable":
+            response = requests.get("https://api.github.com/repos/ThioJoe/Full-Stack-AI-Meme-Generator/releases/latest", timeout=UPDATE_CHECK_TIMEOUT)
+        elif channel == "all":
+            response = requests.get("https://api.github.com/repos/ThioJoe/Full-Stack-AI-Meme-Generator/releases", timeout=UPDATE_CHECK_TIMEOUT)
+    except OSError as ox:
+        write_cache(None, None, str(ox) or type(ox).__name__)
+        raise
+
+    releases = None
+    if response.status_code == 200:
+        # Only keep what the update check uses
+        if channel == "stable":
+            releases = {"name": response.json()["name"], "prerelease": response.json()["prerelease"]}
+        else:
+            releases = [{"name": release["name"], "prerelease": release["prerelease"]} for release in response.json()[:10]]
+
+    write_cache(response.status_code, releases)
+    return response.status_code, releases
+
+# A silent check prints nothing. If it fails, the error message is added to errorMessages (when given) for the caller to show later
+def check_for_update(currentVersion=version, updateReleaseChannel=None, silentCheck=False, errorMessages=None):
     isUpdateAvailable = False
-    print("\nGetting info about latest updates...\n")
+    if silentCheck == False:
+        print("\nGetting info about latest updates...\n")
+
+    def report_silent_error(message):
+        if errorMessages is not None:
+            errorMessages.append(message)
 
     try:
-        if updateReleaseChannel.lower() == "stable":
-            response = requests.get("https://api.github.com/repos/ThioJoe/Full-Stack-AI-Meme-Generator/releases/latest")
-        elif updateReleaseChannel.lower() == "all":
-            response = requests.get("https://api.github.com/repos/ThioJoe/Full-Stack-AI-Meme-Generator/releases")
+        status_code, releases = fetch_release_info(updateReleaseChannel)
 
-        if response.status_code != 200:
-            if response.status_code == 403:
+        if status_code != 200:
+            if status_code == 403:
                 if silentCheck == False:
                     print(f"\nError [U-4]: Got an 403 (ratelimit_reached) when attempting to check for update.")
                     print(f"This means you have been rate limited by github.com. Please try again in a while.\n")
                 else:
-                    print(f"\nError [U-4]: Got an 403 (ratelimit_reached) when attempting to check for update.")
+                    report_silent_error("Error [U-4]: Got an 403 (ratelimit_reached) when attempting to check for update.")
                 return None
 
             else:
                 if silentCheck == False:
-                    print(f"Error [U-3]: Got non 200 status code (got: {response.status_code}) when attempting to check for update.\n")
+                    print(f"Error [U-3]: Got non 200 status code (got: {status_code}) when attempting to check for update.\n")
                     print(f"If this keeps happening, you may want to report the issue here: https://github.com/ThioJoe/Full-Stack-AI-Meme-Generator/issues")
                 else:
-                    print(f"Error [U-3]: Got non 200 status code (got: {response.status_code}) when attempting to check for update.\n")
+                    report_silent_error(f"Error [U-3]: Got non 200 status code (got: {status_code}) when attempting to check for update.")
                 return None
 
         else:
             # assume 200 response (good)
             if updateReleaseChannel.lower() == "stable":
-                latestVersion = response.json()["name"]
+                latestVersion = releases["name"]
                 isBeta = False
             elif updateReleaseChannel.lower() == "all":
-                latestVersion = response.json()[0]["name"]
+                latestVersion = releases[0]["name"]
                 # check if latest version is a beta. 
                 # if it is continue, else check for another beta with a higher version in the 10 newest releases 
-                isBeta = response.json()[0]["prerelease"]
+                isBeta = releases[0]["prerelease"]
                 if (isBeta == False): 
                     for i in range(9):
                         # add a "+ 1" to index to not count the first release (already checked)
-                        latestVersion2 = response.json()[i + 1]["name"]
+                        latestVersion2 = releases[i + 1]["name"]
                         # make sure the version is higher than the current version
                         if parse_version(latestVersion2) > parse_version(latestVersion):
                             # update original latest version to the new version
                             latestVersion = latestVersion2
-                            isBeta = response.json()[i + 1]["prerelease"]
+                            isBeta = releases[i + 1]["prerelease"]
                             # exit loop
                             break
 
     except OSError as ox:
         if "WinError 10013" in str(ox):
-            print(f"WinError 10013: The OS blocked the connection to GitHub. Check your firewall settings.\n")
+            message = "WinError 10013: The OS blocked the connection to GitHub. Check your firewall settings."
         else:
-            print(f"Unknown OSError Error occurred while checking for updates\n")
+            message = "Unknown OSError Error occurred while checking for updates"
+        if silentCheck == False:
+            print(message + "\n")
+        else:
+            report_silent_error(message)
         return None
     except Exception as e:
         if silentCheck == False:
@@ -442,7 +1202,7 @@ def check_for_update(currentVersion=version, updateReleaseChannel=None, silentCh
             print(f"Error [Code U-1]: Problem while checking for updates. See above error for more details.\n")
             print("If this keeps happening, you may want to report the issue here: https://github.com/ThioJoe/Full-Stack-AI-Meme-Generator/issues")
         elif silentCheck == True:
-            print(f"Error [Code U-1]: Unknown problem while checking for updates. See above error for more details.\n")
+            report_silent_error(f"Error [Code U-1]: Unknown problem while checking for updates: {e}")
         return None
 
     if parse_version(latestVersion) > parse_version(currentVersion):
@@ -479,6 +1239,38 @@ def check_for_update(currentVersion=version, updateReleaseChannel=None, silentCh
     
     return isUpdateAvailable
 
+# Runs a silent update check on a daemon thread and returns a Future for its result, so the caller never waits on it.
+# The result is the check's result and its error message, or None if it didn't fail
+def start_background_update_check(currentVersion=version, updateReleaseChannel=None):
+    future = Future()
+    def run_check():
+        try:
+            errorMessages = []
+            isUpdateAvailable = check_for_update(currentVersion, updateReleaseChannel, silentCheck=True, errorMessages=errorMessages)
+            future.set_result((isUpdateAvailable, errorMessages[0] if errorMessages else None))
+        except Exception as ex:
+            future.set_exception(ex)
+    threading.Thread(target=run_check, name="update-check", daemon=True).start()
+    return future
+
+# Prints a notice if a finished background update check found a newer version, or its error if it failed. A check that is still running is just skipped
+def report_background_update_check(future):
+    if future is None or not future.done() or future.exception() is not None:
+        return False
+    isUpdateAvailable, errorMessage = future.result()
+    if errorMessage:
+        print(f"\n{errorMessage}")
+    if isUpdateAvailable:
+        print("\n----------------------------- UPDATE AVAILABLE -------------------------------------------")
+        if isUpdateAvailable == "beta":
+            print(f" A new beta version is available! To see what's new visit: https://github.com/ThioJoe/Full-Stack-AI-Meme-Generator/releases ")
+        else:
+            print(f" A new version is available! To see what's new visit: https://github.com/ThioJoe/Full-Stack-AI-Meme-Generator/releases ")
+        print(f"     > Current Version: {version}")
+        print("------------------------------------------------------------------------------------------")
+        return True
+    return False
+
 # Gets the meme text and image prompt from the message sent by the chat bot
 def parse_meme(message):
     # The regex pattern to match
@@ -497,116 +1289,155 @@ def parse_meme(message):
     else:
         return None
     
-# Sends the user message to the chat bot and returns the chat bot's response
+# Sends the user message to the chat bot and returns the chat bot's response. gemini_key can be one key or a sequence of keys to pick from.
+# Raises TextGenerationError if Gemini fails or gives no usable text, so no image is paid for on a failed meme
 def send_and_receive_message(gemini_key, text_model, userMessage, conversationTemp, temperature=0.7):
-    # Configure the Gemini API
-    genai.configure(api_key=gemini_key)
-
+    key_pool = get_key_pool("gemini", [gemini_key] if isinstance(gemini_key, str) else gemini_key)
     try:
-        # Initialize the model with configuration for Gemini 1.5
-        generation_config = genai.types.GenerationConfig(
-            temperature=temperature,
-            top_p=1,
-            top_k=1,
-            max_output_tokens=2048,
-        )
+        return call_with_circuit_breaker("gemini", lambda: key_pool.call(lambda key: request_meme_text(key, text_model, userMessage, conversationTemp, temperature)))
+    except (TextGenerationError, CircuitOpenError, RateLimitQuotaExceededError):
+        raise
+    except Exception as ex:
+        raise TextGenerationError(str(ex), "Gemini", classify_provider_error(ex)) from ex
+
+def request_meme_text(gemini_key, text_model, userMessage, conversationTemp, temperature=0.7):
+    # Initialize the model with configuration for Gemini 1.5
+    generation_config = genai.types.GenerationConfig(
+        temperature=temperature,
+        top_p=1,
+        top_k=1,
+        max_output_tokens=2048,
+    )
 
-        # Set up safety settings
-        safety_settings = [
-            {
-                "category": "HARM_CATEGORY_HARASSMENT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_HATE_SPEECH",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            }
-        ]
+    # Set up safety settings
+    safety_settings = [
+        {
+            "category": "HARM_CATEGORY_HARASSMENT",
+            "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+        },
+        {
+            "category": "HARM_CATEGORY_HATE_SPEECH",
+            "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+        },
+        {
+            "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+            "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+        },
+        {
+            "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+            "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+        }
+    ]
 
-        # Initialize the model
-        model = genai.GenerativeModel(
-            model_name="gemini-1.5-pro-002",
-            generation_config=generation_config,
-            safety_settings=safety_settings
-        )
+    # Initialize the model on the key's own client
+    model = genai.GenerativeModel(
+        model_name="gemini-1.5-pro-002",
+        generation_config=generation_config,
+        safety_settings=safety_settings
+    )
+    model._client = get_gemini_client(gemini_key)
 
-        # Get system prompt from conversation history
-        system_prompt = next((msg["content"] for msg in conversationTemp if msg["role"] == "system"), "")
+    # Get system prompt from conversation history
+    system_prompt = next((msg["content"] for msg in conversationTemp if msg["role"] == "system"), "")
 
-        # Create the full prompt
-        prompt = f"{system_prompt}\n\nUser request: {userMessage}"
+    # Create the full prompt
+    prompt = f"{system_prompt}\n\nUser request: {userMessage}"
 
-        print("Sending request to write meme...")
+    print("Sending request to write meme...")
 
-        # Generate content with proper error handling
-        try:
-            response = model.generate_content(prompt)
-            if hasattr(response, 'text'):
-                return response.text
-            else:
-                print("Warning: Response did not contain expected text attribute")
-                return """Meme Text: "Error: Could not generate meme text"
-Image Prompt: A confused cat looking at a computer screen with error messages"""
-        except Exception as e:
-            print(f"Error in content generation: {str(e)}")
-            return """Meme Text: "Error: AI had trouble generating the meme"
-Image Prompt: A frustrated cat typing on a keyboard"""
+    response = model.generate_content(prompt)
+    # Reading the text raises ValueError when the response has none, e.g. when the safety filters blocked it
+    try:
+        return response.text
+    except ValueError as ex:
+        raise TextGenerationError(f"The response had no text: {ex}", "Gemini", "blocked") from ex
 
-    except Exception as e:
-        print(f"Error in model initialization: {str(e)}")
-        return """Meme Text: "Error: Could not initialize the AI model"
-Image Prompt: A cat looking confused at a broken computer"""
 
+# Loads a font at the given size. Uses the preloaded font bytes when running inside a render pool worker, so the font file is only read from disk once per worker
+def load_font(fontFile, font_size):
+    font_bytes = _worker_font_bytes.get(fontFile)
+    if font_bytes is None:
+        return ImageFont.truetype(fontFile, font_size)
+    return ImageFont.truetype(io.BytesIO(font_bytes), font_size)
 
-def create_meme(image_path, top_text, filePath, fontFile, noFileSave=False, min_scale=0.05, buffer_scale=0.03, font_scale=1):
-    print("Creating meme image...")
-    
-    # Load the image. Can be a path or a file-like object such as IO.BytesIO virtual file
-    image = Image.open(image_path)
+# Number of caption layouts kept by compute_caption_layout()
+LAYOUT_CACHE_SIZE = 1024
 
+# Works out the font size, line wrapping and band height for the meme text. The result only depends on the arguments, so it is memoized,
+# and rendering the same text again (variants, retries, other sizes with the same width) skips all the textbbox measuring
+@functools.lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def compute_caption_layout(top_text, fontFile, image_width, image_mode="RGBA", min_scale=0.05, buffer_scale=0.03, font_scale=1):
     # Calculate buffer size based on buffer_scale
-    buffer_size = int(buffer_scale * image.width)
+    buffer_size = int(buffer_scale * image_width)
 
-    # Get a drawing context
-    d = ImageDraw.Draw(image)
+    # Get a drawing context. Text measurements don't depend on the image size, only its mode
+    d = ImageDraw.Draw(Image.new(image_mode, (1, 1)))
 
     # Split the text into words
     words = top_text.split()
 
     # Initialize the font size and wrapped text
-    font_size = int(font_scale * image.width)
-    fnt = ImageFont.truetype(fontFile, font_size)
+    font_size = int(font_scale * image_width)
+    fnt_size = font_size
+    fnt = load_font(fontFile, fnt_size)
     wrapped_text = top_text
 
     # Try to fit the text on a single line by reducing the font size
-    while d.textbbox((0,0), wrapped_text, font=fnt)[2] > image.width - 2 * buffer_size:
+    while d.textbbox((0,0), wrapped_text, font=fnt)[2] > image_width - 2 * buffer_size:
         font_size *= 0.9  # Reduce the font size by 10%
-        if font_size < min_scale * image.width:
+        if font_size < min_scale * image_width:
             # If the font size is less than the minimum scale, wrap the text
             lines = [words[0]]
             for word in words[1:]:
                 new_line = (lines[-1] + ' ' + word).rstrip()
-                if d.textbbox((0,0), new_line, font=fnt)[2] > image.width - 2 * buffer_size:
+                if d.textbbox((0,0), new_line, font=fnt)[2] > image_width - 2 * buffer_size:
                     lines.append(word)
                 else:
                     lines[-1] = new_line
             wrapped_text = '\n'.join(lines)
             break
-        fnt = ImageFont.truetype(fontFile, int(font_size))
+        fnt_size = int(font_size)
+        fnt = load_font(fontFile, fnt_size)
 
     # Calculate the bounding box of the text
     textbbox_val = d.multiline_textbbox((0,0), wrapped_text, font=fnt)
 
-    # Create a white band for the top text, with a buffer equal to 10% of the font size
+    # Height of the white band for the top text, with a buffer equal to 10% of the font size
     band_height = textbbox_val[3] - textbbox_val[1] + int(font_size * 0.1) + 2 * buffer_size
+
+    return fnt_size, wrapped_text, band_height
+
+# The layout cache counters of this process
+def get_local_layout_cache_stats():
+    info = compute_caption_layout.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max_size": info.maxsize}
+
+# The latest layout cache counters reported by each render pool worker, keyed by process id. Each worker has its own cache
+_worker_layout_stats = {}
+_worker_layout_stats_lock = threading.Lock()
+
+# Returns hit and miss counts for the caption layout cache, for debugging and tuning. With a render pool the layouts are
+# cached in the worker processes, so their counters (sent back with each render) are added to this process's own
+def get_layout_cache_stats():
+    with _worker_layout_stats_lock:
+        all_stats = [get_local_layout_cache_stats()] + list(_worker_layout_stats.values())
+    hits = sum(stats["hits"] for stats in all_stats)
+    misses = sum(stats["misses"] for stats in all_stats)
+    return {
+        "hits": hits,
+        "misses": misses,
+        "size": sum(stats["size"] for stats in all_stats),
+        "max_size": LAYOUT_CACHE_SIZE,
+        "reporting_workers": len(all_stats) - 1,
+        "hit_rate": hits / (hits + misses) if hits + misses else 0.0
+    }
+
+# Fits the meme text onto a white band above the image and returns the combined image
+def compose_meme_image(image, top_text, fontFile, min_scale=0.05, buffer_scale=0.03, font_scale=1):
+    fnt_size, wrapped_text, band_height = compute_caption_layout(top_text, fontFile, image.width, image.mode, min_scale, buffer_scale, font_scale)
+    fnt = load_font(fontFile, fnt_size)
+
+    # Create a white band for the top text
     band = Image.new('RGBA', (image.width, band_height), (255,255,255,255))
 
     # Draw the text on the white band
@@ -623,64 +1454,421 @@ def create_meme(image_path, top_text, filePath, fontFile, noFileSave=False, min_
     new_img.paste(band, (0,0))
     new_img.paste(image, (0, band_height))
 
-    if not noFileSave:
-        # Save the result to a file
-        new_img.save(filePath)
-        
-    # Return image as virtual file
+    return new_img
+
+# Encodes the composed meme as PNG once, and writes those same bytes to the output file unless noFileSave is set
+def encode_meme_image(new_img, filePath, noFileSave=False):
     virtualMemeFile = io.BytesIO()
     new_img.save(virtualMemeFile, format="PNG")
-    
+
+    if not noFileSave:
+        # Save the result to a file
+        with open(filePath, "wb") as meme_file:
+            meme_file.write(virtualMemeFile.getbuffer())
+
     return virtualMemeFile
+
+def create_meme(image_path, top_text, filePath, fontFile, noFileSave=False, min_scale=0.05, buffer_scale=0.03, font_scale=1, render_pool=None):
+    print("Creating meme image...")
+
+    # Hand the work off to the render pool worker processes if one is in use
+    if render_pool is not None:
+        return render_meme_in_pool(render_pool, image_path, top_text, filePath, fontFile, noFileSave, min_scale, buffer_scale, font_scale)
     
+    # Load the image. Can be a path or a file-like object such as IO.BytesIO virtual file
+    image = Image.open(image_path)
 
-def image_generation_request(apiKeys, image_prompt, platform, model, stability_api=None):
-    if platform == "stability" and stability_api:
-        # Set up our initial generation parameters.
-        stability_response = stability_api.generate(
-            prompt=image_prompt,
-            steps=30,       # Amount of inference steps performed on image generation. Defaults to 30.
-            cfg_scale=7.0,  # Influences how strongly your generation is guided to match your prompt.
-            width=1024,     # Generation width, if not included defaults to 512 or 1024 depending on the engine.
-            height=1024,    # Generation height, if not included defaults to 512 or 1024 depending on the engine.
-            samples=1,      # Number of images to generate, defaults to 1 if not included.
-            sampler=generation.SAMPLER_K_DPMPP_2M   # Choose which sampler we want to denoise our generation with.
-        )
+    new_img = compose_meme_image(image, top_text, fontFile, min_scale, buffer_scale, font_scale)
+
+    # Return image as virtual file
+    return encode_meme_image(new_img, filePath, noFileSave)
+
+# =============================================== Render Pool ================================================
+# Text fitting, compositing and PNG encoding hold the GIL, so when several memes are in flight at once they are rendered in a pool of worker processes instead.
+# The source image bytes are handed to the worker through shared memory rather than being pickled, and each worker preloads the font files once when it starts.
+
+# Font file bytes preloaded by a render pool worker, keyed by font file path. Stays empty in the main process
+_worker_font_bytes = {}
+
+_render_pool = None
+# The (render_workers, font_files) the current pool was made with
+_render_pool_key = None
+_render_pool_lock = threading.Lock()
+
+# Workers are started from a clean process instead of forking this one, which may already run Flask and gRPC threads
+def get_render_pool_context():
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+def _render_worker_init(font_files):
+    for font_file in font_files:
+        with open(font_file, "rb") as f:
+            _worker_font_bytes[font_file] = f.read()
 
-        # Set up our warning to print to the console if the adult content classifier is tripped.
-        for resp in stability_response:
-            for artifact in resp.artifacts:
-                if artifact.finish_reason == generation.FILTER:
-                    warnings.warn(
-                        "Your request activated the API's safety filters and could not be processed."
-                        "Please modify the prompt and try again.")
-                if artifact.type == generation.ARTIFACT_IMAGE:
-                    virtual_image_file = io.BytesIO(artifact.binary)
+def _render_worker_task(shm_name, image_size, top_text, filePath, fontFile, noFileSave, min_scale, buffer_scale, font_scale):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        image = Image.open(io.BytesIO(bytes(shm.buf[:image_size])))
+        image.load()
+    finally:
+        shm.close()
+
+    new_img = compose_meme_image(image, top_text, fontFile, min_scale, buffer_scale, font_scale)
+    # The worker's cache counters go back with the image, so the main process can report them
+    return encode_meme_image(new_img, filePath, noFileSave).getvalue(), os.getpid(), get_local_layout_cache_stats()
+
+# Returns the process-wide render pool, creating it on first use. Font files are preloaded by every worker.
+# If the settings change the number of workers or the fonts, a new pool is made and the old one finishes the renders it already has
+def get_render_pool(render_workers, font_files):
+    global _render_pool, _render_pool_key
+    pool_key = (render_workers, tuple(font_files))
+    with _render_pool_lock:
+        if _render_pool is not None and _render_pool_key != pool_key:
+            _render_pool.shutdown(wait=False)
+            _render_pool = None
+        if _render_pool is None:
+            if _render_pool_key is None:
+                atexit.register(shutdown_render_pool)
+            _render_pool = ProcessPoolExecutor(max_workers=render_workers, mp_context=get_render_pool_context(),
+                                               initializer=_render_worker_init, initargs=(tuple(font_files),))
+            _render_pool_key = pool_key
+        return _render_pool
+
+def shutdown_render_pool():
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is not None:
+            _render_pool.shutdown(wait=True)
+            _render_pool = None
+
+# Renders a meme in the render pool and returns the encoded PNG as a virtual file
+def render_meme_in_pool(render_pool, image_path, top_text, filePath, fontFile, noFileSave=False, min_scale=0.05, buffer_scale=0.03, font_scale=1):
+    # Get the raw source image bytes, from either a path or a file-like object
+    if isinstance(image_path, (str, os.PathLike)):
+        with open(image_path, "rb") as f:
+            image_bytes = f.read()
+    else:
+        image_path.seek(0)
+        image_bytes = image_path.read()
+
+    shm = shared_memory.SharedMemory(create=True, size=max(len(image_bytes), 1))
+    try:
+        shm.buf[:len(image_bytes)] = image_bytes
+        try:
+            future = render_pool.submit(_render_worker_task, shm.name, len(image_bytes), top_text, filePath, fontFile, noFileSave, min_scale, buffer_scale, font_scale)
+        except RuntimeError:
+            # The pool was replaced after a settings change while this pipeline still had it. Render here instead
+            new_img = compose_meme_image(Image.open(io.BytesIO(image_bytes)), top_text, fontFile, min_scale, buffer_scale, font_scale)
+            return encode_meme_image(new_img, filePath, noFileSave)
+        meme_bytes, worker_pid, worker_stats = future.result()
+        with _worker_layout_stats_lock:
+            _worker_layout_stats[worker_pid] = worker_stats
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return io.BytesIO(meme_bytes)
+
+# Sends the image prompt to the image platform through its circuit breaker, and returns the image virtual file.
+# timeout limits the ClipDrop request (Stability has its own deadline), and a timeout counts as a provider failure.
+# on_send is called right before the request goes out, after any wait for the rate limit
+def image_generation_request(apiKeys, image_prompt, platform, model, stability_api=None, timeout=60.0, on_send=None):
+    return call_with_circuit_breaker(platform, lambda: request_image(apiKeys, image_prompt, platform, model, stability_api, timeout, on_send))
+
+def request_image(apiKeys, image_prompt, platform, model, stability_api=None, timeout=60.0, on_send=None):
+    if platform == "stability" and stability_api:
+        # The Stability client is already bound to its key, so its pool of one key only applies the rate limit
+        def generate_on_stability(stability_key):
+            if on_send is not None:
+                on_send()
+            # Set up our initial generation parameters.
+            stability_response = stability_api.generate(
+                prompt=image_prompt,
+                steps=30,       # Amount of inference steps performed on image generation. Defaults to 30.
+                cfg_scale=7.0,  # Influences how strongly your generation is guided to match your prompt.
+                width=1024,     # Generation width, if not included defaults to 512 or 1024 depending on the engine.
+                height=1024,    # Generation height, if not included defaults to 512 or 1024 depending on the engine.
+                samples=1,      # Number of images to generate, defaults to 1 if not included.
+                sampler=generation.SAMPLER_K_DPMPP_2M   # Choose which sampler we want to denoise our generation with.
+            )
+
+            # Set up our warning to print to the console if the adult content classifier is tripped.
+            for resp in stability_response:
+                for artifact in resp.artifacts:
+                    if artifact.finish_reason == generation.FILTER:
+                        warnings.warn(
+                            "Your request activated the API's safety filters and could not be processed."
+                            "Please modify the prompt and try again.")
+                    if artifact.type == generation.ARTIFACT_IMAGE:
+                        virtual_image_file = io.BytesIO(artifact.binary)
+            return virtual_image_file
+
+        virtual_image_file = get_key_pool("stability", get_provider_keys(apiKeys, "stability")).call(generate_on_stability)
 
     elif platform == "clipdrop":
-        r = requests.post('https://clipdrop-api.co/text-to-image/v1',
-            files = {
-                'prompt': (None, image_prompt, 'text/plain')
-            },
-            headers = { 'x-api-key': apiKeys.clipdrop_key}
-        )
-        if (r.ok):
-            virtual_image_file = io.BytesIO(r.content) # r.content contains the bytes of the returned image
-        else:
+        def post_to_clipdrop(clipdrop_key):
+            if on_send is not None:
+                on_send()
+            r = requests.post('https://clipdrop-api.co/text-to-image/v1',
+                files = {
+                    'prompt': (None, image_prompt, 'text/plain')
+                },
+                headers = { 'x-api-key': clipdrop_key},
+                timeout = timeout
+            )
+            # The error keeps the response, so the key pool sees a 429's Retry-After
             r.raise_for_status()
+            return io.BytesIO(r.content) # r.content contains the bytes of the returned image
+
+        virtual_image_file = get_key_pool("clipdrop", get_provider_keys(apiKeys, "clipdrop")).call(post_to_clipdrop)
 
     return virtual_image_file
 
+# Creates a single meme from the user prompt using an already set up pipeline, and returns the result dictionary
+def generate_single_meme(pipeline, userEnteredPrompt):
+    # Send request to chat bot to generate meme text and image prompt
+    chatResponse = send_and_receive_message(get_provider_keys(pipeline.apiKeys, "gemini"), pipeline.text_model, userEnteredPrompt, pipeline.conversation, pipeline.temperature)
+
+    # Take chat message and convert to dictionary with meme_text and image_prompt
+    memeDict = parse_meme(chatResponse)
+    if not memeDict:
+        raise TextGenerationError("The response did not contain a meme text and image prompt.", "Gemini", "malformed")
+    image_prompt = memeDict['image_prompt']
+    meme_text = memeDict['meme_text']
+
+    print("\n   Meme Text:  " + meme_text)
+    print("   Image Prompt:  " + image_prompt)
+
+    # Reuses the image of a near-identical past image prompt if there is one, otherwise generates it
+    virtual_image_file, image_platform = generate_or_reuse_image(pipeline.apiKeys, image_prompt, pipeline.image_platform, pipeline.secondary_image_platform, pipeline.model, pipeline.stability_api,
+                                                                 pipeline.hedge_delay, pipeline.image_request_timeout, pipeline.prompt_index, pipeline.image_reuse_threshold)
+
+    # Combine the meme text and image into a meme
+    filePath,fileName = set_file_path(pipeline.base_file_name, pipeline.output_folder, reserve=not pipeline.noFileSave)
+    virtualMemeFile = create_meme(virtual_image_file, meme_text, filePath, pipeline.font_file, noFileSave=pipeline.noFileSave, render_pool=pipeline.render_pool)
+    if not pipeline.noFileSave:
+        write_log_file(userEnteredPrompt, memeDict, filePath, pipeline.output_folder, pipeline.basic_instructions, pipeline.image_special_instructions, image_platform)
+    
+    absoluteFilePath = os.path.abspath(filePath)
+    
+    return {"meme_text": meme_text, "image_prompt": image_prompt, "file_path": absoluteFilePath, "virtual_meme_file": virtualMemeFile, "file_name": fileName, "image_platform": image_platform}
+
+# =============================================== Bulk Generation ================================================
+# Bulk mode runs a large file of prompts through one pipeline with bounded concurrency. Every finished item is appended to a JSONL manifest straight away,
+# and the manifest doubles as the checkpoint: on restart, items already recorded as "ok" are skipped, so a killed run resumes where it stopped.
+
+# Yields (item_id, prompt) pairs from a JSONL or CSV file without loading the whole file. Items without an "id" are identified by their line or row number
+def read_bulk_prompts(bulk_file_path):
+    with open(bulk_file_path, "r", encoding='utf-8', newline='') as bulk_file:
+        if bulk_file_path.lower().endswith(".csv"):
+            for row_number, row in enumerate(csv.DictReader(bulk_file), start=1):
+                prompt = (row.get('prompt') or '').strip()
+                yield (row.get('id') or f"row-{row_number}"), (prompt or "anything")
+        else:
+            for line_number, line in enumerate(bulk_file, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    item = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"WARNING: Skipping invalid JSON on line {line_number} of {bulk_file_path}")
+                    continue
+                if isinstance(item, str):
+                    item = {"prompt": item}
+                if not isinstance(item, dict):
+                    print(f"WARNING: Skipping line {line_number} of {bulk_file_path}, it must be a JSON object or string")
+                    continue
+                prompt = str(item.get('prompt') or '').strip()
+                yield str(item.get('id') or f"line-{line_number}"), (prompt or "anything")
+
+# Returns the ids of items the manifest already records as successfully completed
+def read_bulk_manifest(manifest_path):
+    completed_ids = set()
+    if not os.path.isfile(manifest_path):
+        return completed_ids
+    with open(manifest_path, "r", encoding='utf-8') as manifest_file:
+        for line in manifest_file:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # A partially written last line from a killed run
+                continue
+            if entry.get('status') == 'ok':
+                completed_ids.add(entry.get('id'))
+    return completed_ids
+
+def run_bulk_generation(pipeline, bulk_file_path, manifest_path, concurrency=4):
+    completed_ids = read_bulk_manifest(manifest_path)
+    if completed_ids:
+        print(f"\nResuming bulk run: {len(completed_ids)} items already completed according to {manifest_path}")
+
+    manifest_folder = os.path.dirname(manifest_path)
+    if manifest_folder and not os.path.exists(manifest_folder):
+        os.makedirs(manifest_folder)
+
+    # A run killed mid-write can leave the last line unfinished. Start on a new line so the next entry isn't glued onto it
+    if os.path.isfile(manifest_path) and os.path.getsize(manifest_path) > 0:
+        with open(manifest_path, "rb+") as manifest_file:
+            manifest_file.seek(-1, os.SEEK_END)
+            if manifest_file.read(1) != b"\n":
+                manifest_file.write(b"\n")
+
+    manifest_lock = threading.Lock()
+    counts = {"ok": 0, "error": 0, "skipped": 0}
+
+    def run_item(item_id, prompt):
+        entry = {"id": item_id, "prompt": prompt}
+        try:
+            # While a provider's circuit is open the item waits for it to be tried again, instead of failing straight away like every other item would.
+            # The items in flight all wait, so no new ones are submitted meanwhile
+            while True:
+                try:
+                    memeInfoDict = generate_single_meme(pipeline, prompt)
+                    break
+                except CircuitOpenError as cx:
+                    print(f"\n  Bulk item '{item_id}' waiting for {cx.provider}: {cx}")
+                    time.sleep(max(cx.retry_in, 1.0))
+            entry.update(status="ok", meme_text=memeInfoDict['meme_text'], image_prompt=memeInfoDict['image_prompt'], file_path=memeInfoDict['file_path'])
+        except Exception as ex:
+            print(f"\n  ERROR:  Bulk item '{item_id}' failed. Error: {ex}")
+            entry.update(status="error", error=str(ex))
+
+        # Append and flush each result right away so the manifest always reflects completed work
+        with manifest_lock:
+            manifest_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+            counts[entry['status']] += 1
+
+    with open(manifest_path, "a", encoding='utf-8') as manifest_file, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # Only keep a bounded number of items in flight so huge input files are streamed instead of queued up in memory
+        in_flight = set()
+        for item_id, prompt in read_bulk_prompts(bulk_file_path):
+            if item_id in completed_ids:
+                counts['skipped'] += 1
+                continue
+            if len(in_flight) >= concurrency * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            in_flight.add(executor.submit(run_item, item_id, prompt))
+        wait(in_flight)
+
+    print(f"\n\nBulk run finished. Completed: {counts['ok']}, Failed: {counts['error']}, Skipped (already done): {counts['skipped']}")
+    layout_stats = get_layout_cache_stats()
+    print(f"Caption layout cache: {layout_stats['hits']} hits, {layout_stats['misses']} misses ({layout_stats['hit_rate']:.0%} hit rate)")
+    print_image_reuse_stats()
+    print("Manifest: " + os.path.abspath(manifest_path))
+    return counts
+
+# =============================================== Hedged Image Generation ================================================
+# With a secondary image platform set, a slow or failing primary platform no longer decides the latency or outcome of a meme.
+# If the primary hasn't answered within the hedge delay, the same prompt is also sent to the secondary, and whichever image arrives first wins.
+# The delay counts from when the primary request is actually sent, so time spent queued or waiting for our own rate limit never causes a hedge.
+# An error from either platform fails over to the other straight away. The losing request can't be cancelled mid-flight, so its result is just discarded.
+
+_hedge_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="image-hedge")
+
+# Returns the image virtual file and the name of the platform that produced it
+def hedged_image_generation_request(apiKeys, image_prompt, platform, secondary_platform, model, stability_api=None, hedge_delay=8.0, timeout=60.0):
+    primary_sent = threading.Event()
+    primary = _hedge_executor.submit(image_generation_request, apiKeys, image_prompt, platform, model, stability_api, timeout, primary_sent.set)
+    # A primary that fails before sending (e.g. its circuit is open) must not leave us waiting for it to be sent
+    primary.add_done_callback(lambda future: primary_sent.set())
+    futures = {primary: platform}
+    secondary_started = False
+    last_error = None
+
+    while futures:
+        # Only wait the hedge delay while the secondary platform hasn't been tried yet, starting once the primary request is sent
+        if secondary_started:
+            wait_timeout = None
+        else:
+            primary_sent.wait()
+            wait_timeout = hedge_delay
+        done, pending = wait(futures, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            finished_platform = futures.pop(future)
+            try:
+                virtual_image_file = future.result()
+            except Exception as ex:
+                print(f"Image generation on {finished_platform} failed: {ex}")
+                last_error = ex
+                continue
+            if finished_platform != platform:
+                print(f"Image generated by secondary platform {finished_platform}.")
+            # Whatever is still pending lost the race and its result is discarded
+            for losing_future in futures:
+                losing_future.cancel()
+            return virtual_image_file, finished_platform
+
+        # Hedge after the delay passes, or fail over at once if the primary errored
+        if not secondary_started:
+            secondary_started = True
+            if not done:
+                print(f"No image from {platform} after {hedge_delay} seconds, also sending request to {secondary_platform}...")
+            futures[_hedge_executor.submit(image_generation_request, apiKeys, image_prompt, secondary_platform, model, stability_api, timeout)] = secondary_platform
+
+    raise last_error
+
+# =============================================== Image Reuse ================================================
+# Optional near-duplicate index over past image prompts (see image_prompt_index.py). Enabled by setting Image_Reuse_Threshold above 0
+
+_prompt_indexes = {}
+_prompt_indexes_lock = threading.Lock()
+
+# Returns the process-wide index stored in the folder, loading it on first use. The limits are updated on every call, so changed settings apply to the loaded index
+def get_prompt_index(index_folder, max_entries=0, max_age_days=0):
+    with _prompt_indexes_lock:
+        prompt_index = _prompt_indexes.get(index_folder)
+        if prompt_index is None:
+            prompt_index = ImagePromptIndex(index_folder, max_entries, max_age_days * 86400)
+            _prompt_indexes[index_folder] = prompt_index
+        else:
+            prompt_index.max_entries = max_entries
+            prompt_index.max_age_seconds = max_age_days * 86400
+        return prompt_index
+
+# Returns the lookup and hit counts of each image prompt index loaded in this process, keyed by folder, for debugging and tuning
+def get_image_reuse_stats():
+    with _prompt_indexes_lock:
+        prompt_indexes = dict(_prompt_indexes)
+    return {index_folder: prompt_index.get_stats() for index_folder, prompt_index in prompt_indexes.items()}
+
+def print_image_reuse_stats():
+    for index_folder, reuse_stats in get_image_reuse_stats().items():
+        print(f"Image reuse ({index_folder}): {reuse_stats['hits']} of {reuse_stats['lookups']} images reused ({reuse_stats['hit_rate']:.0%}), {reuse_stats['entries']} entries, {reuse_stats['evictions']} evicted")
+
+# Returns the image for the image prompt and the platform it came from. With a prompt index, the image of a near-identical past image prompt
+# is reused if there is one ("reused" platform), and a newly generated image is added to the index
+def generate_or_reuse_image(apiKeys, image_prompt, image_platform, secondary_image_platform, model, stability_api, hedge_delay, timeout, prompt_index=None, image_reuse_threshold=0.0):
+    if prompt_index is not None:
+        reused_image = prompt_index.find(image_prompt, image_reuse_threshold)
+        if reused_image is not None:
+            image_bytes, matched_prompt, similarity = reused_image
+            print(f"\nReusing image from a similar image prompt ({similarity:.0%} similar): {matched_prompt}")
+            return io.BytesIO(image_bytes), "reused"
+
+    # Send image prompt to image generator, hedged across both platforms if a secondary one is set
+    print("\nSending image creation request...")
+    if secondary_image_platform:
+        virtual_image_file, image_platform = hedged_image_generation_request(apiKeys, image_prompt, image_platform, secondary_image_platform, model, stability_api, hedge_delay, timeout)
+    else:
+        virtual_image_file = image_generation_request(apiKeys, image_prompt, image_platform, model, stability_api, timeout)
+    if prompt_index is not None and virtual_image_file:
+        prompt_index.add(image_prompt, virtual_image_file.getvalue())
+    return virtual_image_file, image_platform
+
 # ==================== RUN ====================
 
-# Set default values for parameters to those at top of script, but can be overridden by command line arguments or by being set when called from another script
-def generate(
+# Resolves the settings, API keys and API clients for a run into the pipeline shared by every meme it creates.
+# Values from settings.ini replace the parameters if Use_This_Config is set, and command line arguments replace both if args is given. Raises NoFontFileError if the font can't be found
+def build_pipeline(
     text_model="gemini-pro",
     temperature=1.0,
     basic_instructions=r'You will create funny memes that are clever and original, and not cliche or lame.',
     image_special_instructions=r'The images should be photographic.',
-    user_entered_prompt="anything",
-    meme_count=1,
     image_platform="clipdrop",
     font_file="arial.ttf",
     base_file_name="meme",
@@ -690,11 +1878,23 @@ def generate(
     clipdrop_key=None,
     noUserInput=False,
     noFileSave=False,
-    release_channel="all"
+    render_workers=0,
+    secondary_image_platform="",
+    hedge_delay=8.0,
+    stability_verbose=False,
+    stability_deadline=120.0,
+    stability_keepalive=300.0,
+    clipdrop_timeout=60.0,
+    image_reuse_threshold=0.0,
+    image_reuse_folder="ImagePromptIndex",
+    image_reuse_max_entries=0,
+    image_reuse_max_age_days=0.0,
+    args=None
 ):
-    
     # Load default settings from settings.ini file
-    settings = get_settings()
+    settings = get_settings(noUserInput=noUserInput)
+    configure_rate_limits(settings)
+    configure_circuit_breakers(settings)
     use_config = settings.get('Use_This_Config', False)
     if use_config:
         text_model = settings.get('Text_Model', text_model)
@@ -705,53 +1905,144 @@ def generate(
         font_file = settings.get('Font_File', font_file)
         base_file_name = settings.get('Base_File_Name', base_file_name)
         output_folder = settings.get('Output_Folder', output_folder)
-        release_channel = settings.get('Release_Channel', release_channel)
-    
-    # Parse the arguments
-    args = parser.parse_args()
+        render_workers = int(settings.get('Render_Workers', render_workers))
+        secondary_image_platform = settings.get('Secondary_Image_Platform', secondary_image_platform)
+        hedge_delay = float(settings.get('Hedge_Delay', hedge_delay))
+        stability_verbose = settings.get('Stability_Verbose', stability_verbose)
+        stability_deadline = float(settings.get('Stability_Deadline', stability_deadline))
+        stability_keepalive = float(settings.get('Stability_Keepalive', stability_keepalive))
+        clipdrop_timeout = float(settings.get('ClipDrop_Timeout', clipdrop_timeout))
+        image_reuse_threshold = float(settings.get('Image_Reuse_Threshold', image_reuse_threshold))
+        image_reuse_folder = settings.get('Image_Reuse_Folder', image_reuse_folder)
+        image_reuse_max_entries = int(settings.get('Image_Reuse_Max_Entries', image_reuse_max_entries))
+        image_reuse_max_age_days = float(settings.get('Image_Reuse_Max_Age_Days', image_reuse_max_age_days))
 
     # If API Keys not provided as parameters, get them from config file or command line arguments
     if not gemini_key:
         apiKeys = get_api_keys(args=args)
     else:
-        apiKeys = ApiKeysTupleClass(gemini_key, clipdrop_key, stability_key)
+        apiKeys = make_api_keys(gemini_key, clipdrop_key, stability_key)
         
     # Validate api keys
-    validate_api_keys(apiKeys, image_platform)
+    validate_api_keys(apiKeys, image_platform, secondary_image_platform)
     # Initialize api clients
-    stability_api, model = initialize_api_clients(apiKeys, image_platform)
+    stability_api, model = initialize_api_clients(apiKeys, image_platform, secondary_image_platform, stability_verbose, stability_deadline, stability_keepalive)
 
     # Check if any settings arguments, and replace the default values with the args if so
-    if args.imageplatform:
-        image_platform = args.imageplatform
-    if args.temperature:
-        temperature = float(args.temperature)
-    if args.basicinstructions:
-        basic_instructions = args.basicinstructions
-    if args.imagespecialinstructions:
-        image_special_instructions = args.imagespecialinstructions
-    if args.nofilesave:
-        noFileSave=True
-    if args.nouserinput:
-        noUserInput=True
+    if args is not None:
+        if args.imageplatform:
+            image_platform = args.imageplatform
+        if args.temperature:
+            temperature = float(args.temperature)
+        if args.basicinstructions:
+            basic_instructions = args.basicinstructions
+        if args.imagespecialinstructions:
+            image_special_instructions = args.imagespecialinstructions
+        if args.nofilesave:
+            noFileSave=True
 
     systemPrompt = construct_system_prompt(basic_instructions, image_special_instructions)
     conversation = [{"role": "system", "content": systemPrompt}]
 
+    font_file = check_font(font_file)
+
+    # Use the render pool for creating the meme images if enabled
+    render_pool = None
+    if render_workers > 0:
+        render_pool = get_render_pool(render_workers, [font_file])
+
+    # Use the image prompt index for reusing images if enabled
+    prompt_index = None
+    if image_reuse_threshold > 0:
+        prompt_index = get_prompt_index(image_reuse_folder, image_reuse_max_entries, image_reuse_max_age_days)
+    
+    return PipelineTupleClass(apiKeys, text_model, temperature, conversation, image_platform, model, stability_api, font_file, base_file_name, output_folder, basic_instructions, image_special_instructions, noFileSave, render_pool, secondary_image_platform, hedge_delay, prompt_index, image_reuse_threshold, clipdrop_timeout)
+
+# Yields each meme's result dictionary as soon as it is finished, with its position in the run under "index". With concurrency above 1 they can arrive out of order.
+# With drop_images, the in-memory image of a meme that was saved to a file is dropped before it is yielded, so memory stays flat however many memes are made
+def iter_pipeline_memes(pipeline, userEnteredPrompt, meme_count, concurrency=1, drop_images=False):
+    def run_one(index):
+        print("\n----------------------------------------------------------------------------------------------------")
+        print(f"Generating meme {index+1} of {meme_count}...")
+        memeInfoDict = generate_single_meme(pipeline, userEnteredPrompt)
+        memeInfoDict['index'] = index
+        if drop_images and not pipeline.noFileSave:
+            memeInfoDict['virtual_meme_file'] = None
+        return memeInfoDict
+
+    if concurrency <= 1:
+        for index in range(meme_count):
+            yield run_one(index)
+        return
+
+    # Only submit as many memes as can run at once, so stopping the iteration early doesn't leave a long queue to finish
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        next_index = 0
+        in_flight = set()
+        while next_index < meme_count or in_flight:
+            while next_index < meme_count and len(in_flight) < concurrency:
+                in_flight.add(executor.submit(run_one, next_index))
+                next_index += 1
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+# Generator version of generate() for use from other scripts. Never prompts for input, and takes the same settings parameters as build_pipeline()
+def iter_generate(user_entered_prompt="anything", meme_count=1, concurrency=1, drop_images=False, **pipeline_options):
+    pipeline = build_pipeline(noUserInput=True, **pipeline_options)
+    yield from iter_pipeline_memes(pipeline, user_entered_prompt, meme_count, concurrency, drop_images)
+
+# Set default values for parameters to those at top of script, but can be overridden by command line arguments or by being set when called from another script
+def generate(
+    text_model="gemini-pro",
+    temperature=1.0,
+    basic_instructions=r'You will create funny memes that are clever and original, and not cliche or lame.',
+    image_special_instructions=r'The images should be photographic.',
+    user_entered_prompt="anything",
+    meme_count=1,
+    image_platform="clipdrop",
+    font_file="arial.ttf",
+    base_file_name="meme",
+    output_folder="Outputs",
+    gemini_key=None,
+    stability_key=None,
+    clipdrop_key=None,
+    noUserInput=False,
+    noFileSave=False,
+    release_channel="all",
+    render_workers=0,
+    secondary_image_platform="",
+    hedge_delay=8.0,
+    stability_verbose=False,
+    stability_deadline=120.0
+):
+    # Parse the arguments
+    args = parser.parse_args()
+    if args.nouserinput:
+        noUserInput=True
+    if args.bulkfile:
+        noUserInput=True
+
     try:
-        font_file = check_font(font_file)
+        pipeline = build_pipeline(text_model, temperature, basic_instructions, image_special_instructions, image_platform, font_file, base_file_name, output_folder,
+                                  gemini_key, stability_key, clipdrop_key, noUserInput, noFileSave, render_workers, secondary_image_platform, hedge_delay,
+                                  stability_verbose, stability_deadline, args=args)
     except NoFontFileError as fx:
         print(f"\n  ERROR:  {fx}")
         if not noUserInput:
             input("\nPress Enter to exit...")
         sys.exit()
-    
-    # Check for updates
+    output_folder = pipeline.output_folder
+
+    settings = get_settings(noUserInput=noUserInput)
+    if settings.get('Use_This_Config', False):
+        release_channel = settings.get('Release_Channel', release_channel)
+
+    # Check for updates in the background, the result is shown when the run finishes
+    updateCheck = None
     if not noUserInput:
         if release_channel.lower() == "all" or release_channel.lower() == "stable":
-            updateAvailable = check_for_update(version, release_channel, silentCheck=False)
-            if updateAvailable:
-                input("\nPress Enter to continue...")
+            updateCheck = start_background_update_check(version, release_channel)
                 
     # Clear console
     os.system('cls' if os.name == 'nt' else 'clear')
@@ -759,6 +2050,16 @@ def generate(
     # ---------- Start User Input -----------
     print(f"\n==================== AI Meme Generator - {version} ====================")
 
+    # Bulk mode streams its prompts from a file and records results in the manifest instead of returning them
+    if args.bulkfile:
+        bulk_concurrency = int(args.bulkconcurrency) if args.bulkconcurrency else 4
+        manifest_path = args.bulkmanifest if args.bulkmanifest else os.path.join(output_folder, "bulk_manifest.jsonl")
+        try:
+            run_bulk_generation(pipeline, args.bulkfile, manifest_path, bulk_concurrency)
+        except OSError as ox:
+            print(f"\n  ERROR:  Could not run bulk generation. Error: {ox}")
+        return []
+
     if noUserInput:
         userEnteredPrompt = user_entered_prompt
         meme_count = meme_count
@@ -780,43 +2081,24 @@ def generate(
         else:
             meme_count = int(args.memecount)
 
-    def single_meme_generation_loop():
-        # Send request to chat bot to generate meme text and image prompt
-        chatResponse = send_and_receive_message(apiKeys.gemini_key, text_model, userEnteredPrompt, conversation, temperature)
-
-        # Take chat message and convert to dictionary with meme_text and image_prompt
-        memeDict = parse_meme(chatResponse)
-        image_prompt = memeDict['image_prompt']
-        meme_text = memeDict['meme_text']
-
-        print("\n   Meme Text:  " + meme_text)
-        print("   Image Prompt:  " + image_prompt)
-
-        # Send image prompt to image generator
-        print("\nSending image creation request...")
-        virtual_image_file = image_generation_request(apiKeys, image_prompt, image_platform, model, stability_api)
-
-        # Combine the meme text and image into a meme
-        filePath,fileName = set_file_path(base_file_name, output_folder)
-        virtualMemeFile = create_meme(virtual_image_file, meme_text, filePath, font_file, noFileSave=noFileSave)
-        if not noFileSave:
-            write_log_file(userEnteredPrompt, memeDict, filePath, output_folder, basic_instructions, image_special_instructions, image_platform)
-        
-        absoluteFilePath = os.path.abspath(filePath)
-        
-        return {"meme_text": meme_text, "image_prompt": image_prompt, "file_path": absoluteFilePath, "virtual_meme_file": virtualMemeFile, "file_name": fileName}
-    
     # Create list of dictionaries to hold the results
     memeResultsDictsList = []
 
-    try:
-        for i in range(meme_count):
-            print("\n----------------------------------------------------------------------------------------------------")
-            print(f"Generating meme {i+1} of {meme_count}...")
-            memeInfoDict = single_meme_generation_loop()
+    # Results are added as each meme finishes, so the ones made before an error are still returned, profiled or not
+    def collect_memes():
+        for memeInfoDict in iter_pipeline_memes(pipeline, userEnteredPrompt, meme_count):
             memeResultsDictsList.append(memeInfoDict)
+
+    try:
+        if args.profile:
+            profiles_folder = settings.get('Profiles_Folder', 'Profiles')
+            sample_interval = float(settings.get('Profile_Sample_Interval_Ms', 5)) / 1000
+            profile_call(collect_memes, userEnteredPrompt, profiles_folder, sample_interval)
+        else:
+            collect_memes()
             
         print("\n\nFinished. Output directory: " + os.path.abspath(output_folder))
+        report_background_update_check(updateCheck)
         if not noUserInput:
             input("\nPress Enter to exit...")
     
@@ -831,6 +2113,13 @@ def generate(
         if not noUserInput:
             input("\nPress Enter to exit...")
         sys.exit()
+
+    # A provider failure stops the run before any more image generations are paid for. Memes already made are still returned
+    except (TextGenerationError, CircuitOpenError) as px:
+        print(f"\n  ERROR:  {px}")
+        if not noUserInput:
+            input("\nPress Enter to exit...")
+        return memeResultsDictsList
     
     except Exception as ex:
         traceback.print_exc()
@@ -844,16 +2133,27 @@ def generate(
 def generate_meme(topic):
     try:
         # Load configuration using existing function
-        settings = get_settings()
+        settings = get_settings(noUserInput=True)
+        configure_rate_limits(settings)
+        configure_circuit_breakers(settings)
         
         # Get API keys using existing function with default args
         apiKeys = get_api_keys(args=None)
         
         # Validate API keys
-        validate_api_keys(apiKeys, settings.get('Image_Platform', 'clipdrop'))
+        image_platform = settings.get('Image_Platform', 'clipdrop')
+        secondary_image_platform = settings.get('Secondary_Image_Platform', '')
+        validate_api_keys(apiKeys, image_platform, secondary_image_platform)
         
         # Initialize API clients
-        stability_api, model = initialize_api_clients(apiKeys, settings.get('Image_Platform', 'clipdrop'))
+        stability_api, model = initialize_api_clients(
+            apiKeys,
+            image_platform,
+            secondary_image_platform,
+            settings.get('Stability_Verbose', False),
+            float(settings.get('Stability_Deadline', 120.0)),
+            float(settings.get('Stability_Keepalive', 300.0))
+        )
         
         # Create system prompt
         basic_instructions = settings.get('Basic_Instructions', 'You will create funny memes that are clever and original, and not cliche or lame.')
@@ -863,7 +2163,7 @@ def generate_meme(topic):
         
         # Generate meme text and image using the loaded settings
         chatResponse = send_and_receive_message(
-            apiKeys.gemini_key,
+            get_provider_keys(apiKeys, "gemini"),
             settings.get('Text_Model', 'gemini-1.5-pro-002'),
             topic,
             conversation,
@@ -884,13 +2184,26 @@ def generate_meme(topic):
         print("\nMeme Text:", meme_text)
         print("Image Prompt:", image_prompt)
         
-        # Generate image using existing function
-        virtual_image_file = image_generation_request(
-            apiKeys, 
-            image_prompt, 
-            settings.get('Image_Platform', 'clipdrop'),
+        # Reuse the image of a near-identical past image prompt if enabled, otherwise generate it (hedged if a secondary platform is set)
+        image_reuse_threshold = float(settings.get('Image_Reuse_Threshold', 0))
+        prompt_index = None
+        if image_reuse_threshold > 0:
+            prompt_index = get_prompt_index(
+                settings.get('Image_Reuse_Folder', 'ImagePromptIndex'),
+                int(settings.get('Image_Reuse_Max_Entries', 0)),
+                float(settings.get('Image_Reuse_Max_Age_Days', 0))
+            )
+        virtual_image_file, image_platform = generate_or_reuse_image(
+            apiKeys,
+            image_prompt,
+            image_platform,
+            secondary_image_platform,
             model,
-            stability_api
+            stability_api,
+            float(settings.get('Hedge_Delay', 8.0)),
+            float(settings.get('ClipDrop_Timeout', 60.0)),
+            prompt_index,
+            image_reuse_threshold
         )
         
         if not virtual_image_file:
@@ -907,6 +2220,12 @@ def generate_meme(topic):
         
         # Check font file
         font_file = check_font(settings.get('Font_File', 'arial.ttf'))
+
+        # Use the render pool if enabled
+        render_pool = None
+        render_workers = int(settings.get('Render_Workers', 0))
+        if render_workers > 0:
+            render_pool = get_render_pool(render_workers, [font_file])
         
         # Create the meme using existing function
         virtualMemeFile = create_meme(
@@ -914,7 +2233,8 @@ def generate_meme(topic):
             meme_text,
             filePath,
             font_file,
-            noFileSave=False
+            noFileSave=False,
+            render_pool=render_pool
         )
         
         # Write to log file
@@ -925,7 +2245,7 @@ def generate_meme(topic):
             settings.get('Output_Folder', 'Outputs'),
             basic_instructions,
             image_special_instructions,
-            settings.get('Image_Platform', 'clipdrop')
+            image_platform
         )
         
         return {
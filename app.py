@@ -1,20 +1,320 @@
 from flask import Flask, request, jsonify, send_file, render_template, redirect, url_for, session
 import os
-from AIMemeGenerator import generate
+from AIMemeGenerator import (generate, get_rate_limit_status, get_settings, get_provider_wait_time, get_circuit_breaker, get_circuit_breaker_status,
+                             get_layout_cache_stats, get_image_reuse_stats)
 import io
 from functools import wraps
 import re
+import hashlib
+import threading
+import time
+import gzip
+import uuid
+from werkzeug.security import generate_password_hash, check_password_hash
+from meme_store import MemeStore
+from pregeneration import PregenerationPool
+from request_profiler import profile_call
+from worker import get_job_queue
+
+# Brotli is optional. Without it responses are gzip compressed
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'  # Change this to a secure secret key
 
-# Simulated user database (replace with a real database in production)
-users = {
-    'test@example.com': {
-        'password': 'password123',
-        'name': 'Test User'
+# ------------ RESPONSE COMPRESSION AND CACHING ------------
+# Text responses above the size threshold are compressed (brotli if the browser and server support it, otherwise gzip).
+# Pages and JSON get an ETag so an unchanged response costs a 304 instead of a full body. They depend on the session, so they are private and always revalidated.
+# Static files are linked with a content hash in the URL (?v=...), so they can be cached for a year and are refetched only when the file changes.
+
+COMPRESS_MIN_SIZE = 1024
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/css', 'text/plain', 'text/javascript', 'application/javascript', 'application/json', 'image/svg+xml'}
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+# Fingerprints of static files, keyed by filename, kept until the file changes: filename -> (mtime, hash)
+_static_versions = {}
+# Compressed static files, keyed by (ETag, encoding), so each version of a file is only compressed once
+_compressed_static = {}
+
+# Returns a short content hash of a file in the static folder, or None if it doesn't exist
+def static_version(filename):
+    path = os.path.join(app.static_folder, filename)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    cached = _static_versions.get(filename)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, 'rb') as static_file:
+        version = hashlib.sha1(static_file.read()).hexdigest()[:12]
+    _static_versions[filename] = (mtime, version)
+    return version
+
+@app.url_defaults
+def add_static_version(endpoint, values):
+    # url_for('static', filename=...) links to the current version of the file
+    if endpoint == 'static' and 'v' not in values:
+        version = static_version(values.get('filename', ''))
+        if version:
+            values['v'] = version
+
+@app.context_processor
+def inject_static_assets():
+    # base.html links the prebuilt Tailwind stylesheet. The in-browser compiler is only a fallback for when it has been deleted during development
+    return {'prebuilt_tailwind': static_version('css/tailwind.css') is not None}
+
+def choose_encoding():
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+def compress_data(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    # mtime=0 makes the output depend only on the data
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+@app.after_request
+def compress_and_cache(response):
+    is_static = request.endpoint == 'static'
+    if is_static:
+        if request.args.get('v'):
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = STATIC_MAX_AGE
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+    elif response.mimetype in ('text/html', 'application/json'):
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+
+    if (response.status_code != 200 or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or 'Content-Encoding' in response.headers or (response.direct_passthrough and not is_static)):
+        return response
+
+    response.direct_passthrough = False
+    data = response.get_data()
+    encoding = None
+    if len(data) >= COMPRESS_MIN_SIZE:
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding()
+
+    if request.method in ('GET', 'HEAD'):
+        # Static files already have an ETag. The encoding is part of it, since the compressed body differs from the plain one
+        etag = response.get_etag()[0] or hashlib.sha1(data).hexdigest()
+        response.set_etag(f"{etag}-{encoding}" if encoding else etag)
+        response.make_conditional(request)
+        if response.status_code == 304:
+            return response
+
+    if encoding:
+        if is_static:
+            key = (response.get_etag()[0], encoding)
+            compressed = _compressed_static.get(key)
+            if compressed is None:
+                compressed = _compressed_static[key] = compress_data(data, encoding)
+        else:
+            compressed = compress_data(data, encoding)
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+# Users and meme history, stored in SQLite so they survive restarts and are shared by all worker processes
+store = MemeStore(os.environ.get('MEME_DB_PATH', 'memes.db'))
+
+# Test account for trying out the app
+if not store.get_user('test@example.com'):
+    store.create_user('test@example.com', 'Test User', generate_password_hash('password123'))
+
+# Coalesces identical generation requests that arrive while one is already running.
+# Up to fan_out distinct generations run per key, and every further request attaches to one of them (round robin) and gets its result,
+# so a trending prompt costs at most fan_out provider calls at a time no matter how many users send it.
+class SingleFlight:
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._next_follow = {}
+
+    def do(self, key, fn, fan_out=1):
+        with self._lock:
+            calls = self._calls.setdefault(key, [])
+            if len(calls) < fan_out:
+                call = SingleFlight._Call()
+                calls.append(call)
+                is_leader = True
+            else:
+                index = self._next_follow.get(key, 0)
+                self._next_follow[key] = index + 1
+                call = calls[index % len(calls)]
+                is_leader = False
+
+        if is_leader:
+            try:
+                call.result = fn()
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    calls.remove(call)
+                    if not calls:
+                        del self._calls[key]
+                        self._next_follow.pop(key, None)
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+generation_flights = SingleFlight()
+
+# Requests are only coalesced if both the prompt and the generation settings match
+def generation_key(prompt, settings):
+    normalized_prompt = ' '.join(prompt.lower().split())
+    settings_hash = hashlib.sha1(repr(sorted(settings.items())).encode('utf-8')).hexdigest()
+    return (normalized_prompt, settings_hash)
+
+# Generates one meme for the prompt, and returns its PNG bytes and text, or None if it failed
+def run_generation(prompt):
+    # Generate the meme using the existing function
+    result = generate(
+        user_entered_prompt=prompt,
+        noUserInput=True,  # Don't prompt for user input
+        noFileSave=True    # Don't save to file system
+    )
+    
+    # Get the virtual meme file from the result
+    if result and isinstance(result, list) and len(result) > 0:
+        meme_info = result[0]  # Get first meme result
+        virtual_meme_file = meme_info.get('virtual_meme_file')
+        if virtual_meme_file:
+            return {
+                'png': virtual_meme_file.getvalue(),
+                'meme_text': meme_info.get('meme_text'),
+                'image_prompt': meme_info.get('image_prompt')
+            }
+    return None
+
+# Pregeneration only uses spare capacity: nothing else is being generated, no provider has a queue, and no provider's circuit is open
+def providers_idle():
+    if generation_flights.in_flight():
+        return False
+    settings = get_settings(noUserInput=True)
+    platforms = ['gemini', settings.get('Image_Platform', 'clipdrop')]
+    return all(get_provider_wait_time(platform) == 0 and get_circuit_breaker(platform).state == 'closed' for platform in platforms)
+
+def start_pregeneration_pool():
+    settings = get_settings(noUserInput=True)
+    # In worker mode this process doesn't generate memes itself
+    if not settings.get('Pregeneration_Enabled', False) or settings.get('Worker_Mode', False):
+        return None
+    pool = PregenerationPool(
+        run_generation,
+        is_idle=providers_idle,
+        hot_topics=int(settings.get('Pregeneration_Hot_Topics', 5)),
+        per_topic=int(settings.get('Pregeneration_Per_Topic', 2)),
+        max_age=float(settings.get('Pregeneration_Max_Age_Minutes', 60)) * 60,
+        budget_per_hour=int(settings.get('Pregeneration_Budget_Per_Hour', 10)),
+        log_path=os.path.join(settings.get('Output_Folder', 'Outputs'), 'log.txt'),
+        store=store
+    )
+    pool.start()
+    return pool
+
+# The pool is started by the first request rather than on import, so processes that only import app.py
+# (such as render workers started with spawn, which import it as __mp_main__) never run a refill thread
+pregeneration_pool = None
+_pregeneration_pool_started = False
+_pregeneration_pool_lock = threading.Lock()
+
+@app.before_request
+def ensure_pregeneration_pool():
+    global pregeneration_pool, _pregeneration_pool_started
+    if _pregeneration_pool_started:
+        return
+    with _pregeneration_pool_lock:
+        if not _pregeneration_pool_started:
+            pregeneration_pool = start_pregeneration_pool()
+            _pregeneration_pool_started = True
+
+# In worker mode /generate only queues a job, and worker processes (worker.py) generate the memes.
+# The queue follows the current settings, so Worker_Mode and the job settings can be changed without restarting the app.
+# It is only reopened when the queue path or job settings change
+_job_queue = None
+_job_queue_key = None
+_job_queue_lock = threading.Lock()
+
+def get_active_job_queue(settings):
+    global _job_queue, _job_queue_key
+    if not settings.get('Worker_Mode', False):
+        return None
+    key = (os.environ.get('MEME_QUEUE_PATH', 'jobs.db'), float(settings.get('Job_Lease_Seconds', 60)), int(settings.get('Job_Max_Attempts', 3)))
+    with _job_queue_lock:
+        if key != _job_queue_key:
+            _job_queue = get_job_queue(settings)
+            _job_queue_key = key
+        return _job_queue
+
+# Status of a job for the client. A job that could have been claimed for longer than Job_Stuck_Seconds is flagged as stuck,
+# which usually means no worker.py process is running
+def job_status(job, settings):
+    queued_for = time.time() - job['available_at'] if job['status'] == 'queued' else 0
+    stuck = queued_for > float(settings.get('Job_Stuck_Seconds', 120))
+    return {
+        'job_id': job['id'],
+        'status': job['status'],
+        'attempts': job['attempts'],
+        'meme_id': job['result']['meme_id'] if job['result'] else None,
+        'error': f"No worker has picked up this job for {queued_for:.0f} seconds" if stuck else job['error'],
+        'stuck': stuck
     }
-}
+
+# A client that retries a request with the same Idempotency-Key header gets the same job instead of a new meme
+def generation_job_id(user, idempotency_key):
+    if not idempotency_key:
+        return uuid.uuid4().hex
+    return hashlib.sha1(f"{user}\n{idempotency_key}".encode('utf-8')).hexdigest()
+
+# Returns the meme image once the job is done, or the job's status if it failed or is still running
+def job_response(job):
+    if job['status'] == 'done':
+        png = store.get_meme_image(session['user'], job['result']['meme_id'])
+        if png is not None:
+            response = send_file(io.BytesIO(png), mimetype='image/png')
+            response.headers['X-Meme-Id'] = str(job['result']['meme_id'])
+            response.headers['X-Job-Id'] = job['id']
+            return response
+    if job['status'] in ('done', 'failed'):
+        return jsonify({'error': job['error'] or 'Failed to generate meme', 'job_id': job['id']}), 500
+    response = jsonify(job_status(job, get_settings(noUserInput=True)))
+    response.status_code = 202
+    response.headers['Location'] = url_for('get_job', job_id=job['id'])
+    return response
+
+# Profiling a generation is only allowed for the accounts listed in Profile_Admins
+def profiling_requested(settings):
+    if request.headers.get('X-Profile') != '1' and request.args.get('profile') != '1':
+        return False
+    admins = [email.strip().lower() for email in str(settings.get('Profile_Admins', '')).split(',') if email.strip()]
+    return session.get('user') in admins
 
 def login_required(f):
     @wraps(f)
@@ -59,14 +359,9 @@ def register():
     if not is_valid_password(password):
         return jsonify({'error': 'Password must be at least 8 characters long'}), 400
 
-    if email in users:
-        return jsonify({'error': 'Email already registered'}), 400
-
     # Store new user
-    users[email] = {
-        'password': password,
-        'name': name
-    }
+    if not store.create_user(email, name, generate_password_hash(password)):
+        return jsonify({'error': 'Email already registered'}), 400
 
     return jsonify({'success': True, 'message': 'Registration successful'})
 
@@ -79,7 +374,8 @@ def login():
     email = data.get('email', '').strip().lower()
     password = data.get('password')
     
-    if email in users and users[email]['password'] == password:
+    user = store.get_user(email)
+    if user and password and check_password_hash(user['password_hash'], password):
         session['user'] = email
         return jsonify({'success': True})
     
@@ -103,39 +399,146 @@ def profile():
 @login_required
 def get_user():
     user_email = session['user']
+    user = store.get_user(user_email)
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
     return jsonify({
         'email': user_email,
-        'name': users[user_email]['name']
+        'name': user['name']
     })
 
+@app.route('/api/history')
+@login_required
+def get_history():
+    # Keyset pagination: pass the returned next_before back as ?before= to get the next page
+    before = request.args.get('before', type=int)
+    limit = request.args.get('limit', 20, type=int)
+    memes, next_before = store.get_history(session['user'], before_id=before, limit=limit)
+    return jsonify({'memes': memes, 'next_before': next_before})
+
+@app.route('/api/history', methods=['DELETE'])
+@login_required
+def clear_history():
+    store.clear_history(session['user'])
+    return jsonify({'success': True})
+
+@app.route('/api/history/<int:meme_id>', methods=['DELETE'])
+@login_required
+def delete_history_meme(meme_id):
+    if not store.delete_meme(session['user'], meme_id):
+        return jsonify({'error': 'Meme not found'}), 404
+    return jsonify({'success': True})
+
+@app.route('/api/history/<int:meme_id>/image')
+@login_required
+def get_history_meme_image(meme_id):
+    png = store.get_meme_image(session['user'], meme_id)
+    if png is None:
+        return jsonify({'error': 'Meme not found'}), 404
+    return send_file(io.BytesIO(png), mimetype='image/png')
+
+@app.route('/api/rate_limits')
+@login_required
+def rate_limits():
+    # Current wait time and daily quota usage for each AI provider
+    return jsonify(get_rate_limit_status())
+
+@app.route('/api/circuit_breakers')
+@login_required
+def circuit_breakers():
+    # State, failure counts by error class and rejected requests for each AI provider
+    return jsonify(get_circuit_breaker_status())
+
+@app.route('/api/cache_stats')
+@login_required
+def cache_stats():
+    # Hit rates of the caption layout cache, including the render pool workers' caches, and of the image prompt indexes loaded by this process
+    return jsonify({'layout': get_layout_cache_stats(), 'image_reuse': get_image_reuse_stats()})
+
+@app.route('/api/jobs')
+@login_required
+def job_stats():
+    job_queue = get_active_job_queue(get_settings(noUserInput=True))
+    if job_queue is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(job_queue.get_stats(), enabled=True))
+
+@app.route('/api/jobs/<job_id>')
+@login_required
+def get_job(job_id):
+    settings = get_settings(noUserInput=True)
+    job_queue = get_active_job_queue(settings)
+    job = job_queue.get_job(job_id) if job_queue is not None else None
+    if job is None or job['payload']['user'] != session['user']:
+        return jsonify({'error': 'Job not found'}), 404
+    if request.args.get('wait', type=float):
+        job = job_queue.wait_for_job(job_id, timeout=min(request.args.get('wait', type=float), 60))
+    return jsonify(job_status(job, settings))
+
+@app.route('/api/pregeneration')
+@login_required
+def pregeneration_status():
+    if pregeneration_pool is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(pregeneration_pool.get_status(), enabled=True))
+
 @app.route('/generate', methods=['POST'])
 @login_required
 def generate_meme():
     try:
         data = request.json
         prompt = data.get('prompt', '')
-        
-        # Generate the meme using the existing function
-        result = generate(
-            user_entered_prompt=prompt,
-            noUserInput=True,  # Don't prompt for user input
-            noFileSave=True    # Don't save to file system
-        )
-        
-        # Get the virtual meme file from the result
-        if result and isinstance(result, list) and len(result) > 0:
-            meme_info = result[0]  # Get first meme result
-            virtual_meme_file = meme_info.get('virtual_meme_file')
-            
-            if virtual_meme_file:
-                # Seek to beginning of file
-                virtual_meme_file.seek(0)
-                
-                # Return the image directly
-                return send_file(
-                    virtual_meme_file,
-                    mimetype='image/png'
-                )
+
+        settings = get_settings(noUserInput=True)
+        fan_out = int(settings.get('Coalesce_Fan_Out', 1))
+        job_queue = get_active_job_queue(settings)
+
+        profile_path = None
+        if profiling_requested(settings):
+            # A profiled request always runs its own generation, so the profile shows the real work
+            meme, profile_path = profile_call(
+                lambda: run_generation(prompt),
+                prompt,
+                settings.get('Profiles_Folder', 'Profiles'),
+                float(settings.get('Profile_Sample_Interval_Ms', 5)) / 1000
+            )
+        elif job_queue is not None:
+            # Queue the job and wait a while for a worker to finish it. If it takes longer, the client polls /api/jobs/<job_id>
+            job_id = generation_job_id(session['user'], request.headers.get('Idempotency-Key'))
+            job_queue.enqueue(job_id, {'prompt': prompt, 'user': session['user']})
+            return job_response(job_queue.wait_for_job(job_id, timeout=float(settings.get('Job_Wait_Seconds', 60))))
+        else:
+            # Serve a ready-made meme from the pregeneration pool if there is one
+            meme = None
+            if pregeneration_pool is not None:
+                pregeneration_pool.record_request(prompt)
+                meme = pregeneration_pool.take(prompt)
+
+            # Fail fast while Gemini's circuit is open, since no meme can be written without it
+            gemini_status = get_circuit_breaker('gemini').get_status()
+            if meme is None and gemini_status['state'] == 'open' and gemini_status['retry_in'] > 0:
+                response = jsonify({'error': 'Meme generation is temporarily unavailable, please try again shortly'})
+                response.status_code = 503
+                response.headers['Retry-After'] = str(max(1, round(gemini_status['retry_in'])))
+                return response
+
+            # Identical requests already in flight share their result instead of starting another generation
+            if meme is None:
+                meme = generation_flights.do(generation_key(prompt, settings), lambda: run_generation(prompt), fan_out)
+
+        if meme:
+            # Save it to the user's history
+            meme_id = store.add_meme(session['user'], prompt, meme['meme_text'], meme['image_prompt'], meme['png'])
+
+            # Return the image directly. Each request gets its own file object over the shared bytes
+            response = send_file(
+                io.BytesIO(meme['png']),
+                mimetype='image/png'
+            )
+            response.headers['X-Meme-Id'] = str(meme_id)
+            if profile_path:
+                response.headers['X-Profile-Path'] = profile_path
+            return response
         
         return jsonify({'error': 'Failed to generate meme'}), 500
         
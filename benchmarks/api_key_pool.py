@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# Benchmark for API key pools
+# Sends a batch of stubbed ClipDrop requests from many threads through pools of 1, 2, 4 and 8 keys, each key limited to the same
+# requests per second, and shows throughput growing with the number of keys. A second run has one key answer 429 and another 403,
+# and checks the requests move to the healthy keys.
+# Run from the project folder:   python benchmarks/api_key_pool.py
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from io import StringIO
+
+import requests
+
+sys.argv = sys.argv[:1]  # AIMemeGenerator parses the command line when imported
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import AIMemeGenerator
+
+REQUESTS = 100
+THREADS = 32
+REQUESTS_PER_SECOND_PER_KEY = 10
+PROVIDER_SECONDS = 0.02
+
+class StubResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+def run(keys, failing_keys=None):
+    failing_keys = failing_keys or {}
+    used = Counter()
+
+    def stub_request(key):
+        used[key] += 1
+        time.sleep(PROVIDER_SECONDS)
+        if key in failing_keys:
+            error = requests.HTTPError(f"{failing_keys[key].status_code} error")
+            error.response = failing_keys[key]
+            raise error
+        return key
+
+    pool = AIMemeGenerator.get_key_pool("clipdrop", keys)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        list(executor.map(lambda _: pool.call(stub_request), range(REQUESTS)))
+    return REQUESTS / (time.perf_counter() - start), used
+
+def main():
+    AIMemeGenerator.configure_rate_limits({
+        "ClipDrop_Requests_Per_Second": REQUESTS_PER_SECOND_PER_KEY,
+        "ClipDrop_Burst": 1,
+        "Key_Ejection_Seconds": 60,
+    })
+
+    print(f"{REQUESTS} requests from {THREADS} threads, each key limited to {REQUESTS_PER_SECOND_PER_KEY} requests/s")
+    for key_count in (1, 2, 4, 8):
+        keys = tuple(f"key-{key_count}-{n}" for n in range(key_count))
+        rate, used = run(keys)
+        print(f"{key_count} keys:  {rate:6.1f} requests/s   per key {sorted(used.values())}")
+
+    keys = ("bad-rate-limited", "bad-forbidden", "good-1", "good-2")
+    failing_keys = {"bad-rate-limited": StubResponse(429, {"Retry-After": "60"}), "bad-forbidden": StubResponse(403)}
+    with redirect_stdout(StringIO()):
+        rate, used = run(keys, failing_keys)
+    print(f"\n4 keys, one answering 429 and one 403:  {rate:6.1f} requests/s   requests per key {dict(used)}")
+
+if __name__ == "__main__":
+    main()
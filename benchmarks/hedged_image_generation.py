@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# Benchmark for hedged image generation
+# Replaces the real ClipDrop and Stability calls with stubbed backends that have a long latency tail and occasional errors,
+# then compares per-meme latency of single-platform generation against hedged generation, and counts which platform won.
+# Run from the project folder:   python benchmarks/hedged_image_generation.py
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.argv = sys.argv[:1]  # AIMemeGenerator parses the command line when imported
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import AIMemeGenerator
+
+REQUESTS = 200
+HEDGE_DELAY = 0.15
+# Seconds of latency: mostly fast, with a slow tail on each platform
+BACKENDS = {
+    "clipdrop": {"median": 0.08, "slow_chance": 0.08, "slow": 1.0, "error_chance": 0.03},
+    "stability": {"median": 0.10, "slow_chance": 0.05, "slow": 0.8, "error_chance": 0.02},
+}
+
+def stub_image_generation_request(apiKeys, image_prompt, platform, model, stability_api=None, timeout=60.0, on_send=None):
+    if on_send is not None:
+        on_send()
+    backend = BACKENDS[platform]
+    latency = random.lognormvariate(0, 0.3) * backend["median"]
+    if random.random() < backend["slow_chance"]:
+        latency += backend["slow"]
+    time.sleep(latency)
+    if random.random() < backend["error_chance"]:
+        raise RuntimeError(f"stubbed {platform} error")
+    return io.BytesIO(b"image")
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def run(label, generate_one):
+    latencies, failures, winners = [], 0, Counter()
+    for i in range(REQUESTS):
+        start = time.perf_counter()
+        try:
+            # Keep the generator's progress messages out of the results table
+            with contextlib.redirect_stdout(io.StringIO()):
+                winners[generate_one()] += 1
+            latencies.append(time.perf_counter() - start)
+        except RuntimeError:
+            failures += 1
+    print(f"{label:<30} p50 {percentile(latencies, 50)*1000:7.1f} ms   p95 {percentile(latencies, 95)*1000:7.1f} ms   p99 {percentile(latencies, 99)*1000:7.1f} ms   failed {failures:3d}   winners {dict(winners)}")
+    return latencies
+
+def main():
+    random.seed(1)
+    AIMemeGenerator.image_generation_request = stub_image_generation_request
+    apiKeys = AIMemeGenerator.ApiKeysTupleClass("gemini", "clipdrop", "stability")
+
+    def single():
+        AIMemeGenerator.image_generation_request(apiKeys, "a cat", "clipdrop", None)
+        return "clipdrop"
+
+    def hedged():
+        return AIMemeGenerator.hedged_image_generation_request(apiKeys, "a cat", "clipdrop", "stability", None, hedge_delay=HEDGE_DELAY)[1]
+
+    print(f"{REQUESTS} requests per mode, hedge delay {HEDGE_DELAY*1000:.0f} ms\n")
+    single_latencies = run("clipdrop only", single)
+    hedged_latencies = run("clipdrop, hedged to stability", hedged)
+    print(f"\np99 improvement: {(percentile(single_latencies, 99) - percentile(hedged_latencies, 99))*1000:.1f} ms")
+
+if __name__ == "__main__":
+    main()
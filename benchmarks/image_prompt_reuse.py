@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# Benchmark for the near-duplicate image prompt index
+# Replays the image prompts from a generation log through a fresh index, the way generate_single_meme() uses it, and reports
+# how many image generation calls would have been saved and how long lookups take. Each logged prompt is also replayed with a few
+# sibling rewordings (like the ones Gemini produces for the same idea), and a large synthetic index is used to check lookup latency at scale.
+# Run from the project folder:   python benchmarks/image_prompt_reuse.py [log.txt] [threshold]
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from image_prompt_index import ImagePromptIndex
+
+SYNTHETIC_ENTRIES = 20000
+SUBJECTS = ["cat", "dog", "programmer", "toddler", "grandma", "robot", "penguin", "office worker", "teenager", "goldfish"]
+ACTIONS = ["staring at", "yelling at", "hiding behind", "laughing at", "confused by", "running from", "hugging", "ignoring"]
+OBJECTS = ["a computer screen", "a cucumber", "a vacuum cleaner", "a birthday cake", "an alarm clock", "a tax form", "a smartphone", "a mirror"]
+STYLES = ["photograph", "cartoon style", "oil painting", "dimly lit room", "studio lighting", "wide angle"]
+
+def read_logged_prompts(log_path):
+    with open(log_path, "r", encoding='utf-8') as log_file:
+        return [match.group(1).strip() for match in re.finditer(r"^\s*Chat Bot Image Prompt: (.*)$", log_file.read(), re.MULTILINE)]
+
+# Small rewordings of a prompt: a dropped word, a changed style suffix, an added adjective
+def sibling_prompts(prompt, rng):
+    words = prompt.split()
+    siblings = []
+    if len(words) > 4:
+        drop = rng.randrange(1, len(words))
+        siblings.append(' '.join(words[:drop] + words[drop + 1:]))
+    siblings.append(prompt.rstrip('.') + ", " + rng.choice(STYLES))
+    siblings.append("photograph of " + prompt[0].lower() + prompt[1:] if not prompt.lower().startswith("photograph") else prompt.replace("photograph of ", "", 1))
+    return siblings
+
+def replay(index, prompts, threshold):
+    api_calls, timings = 0, []
+    for prompt in prompts:
+        start = time.perf_counter()
+        match = index.find(prompt, threshold)
+        timings.append(time.perf_counter() - start)
+        if match is None:
+            api_calls += 1
+            index.add(prompt, prompt.encode('utf-8'))
+    return api_calls, timings
+
+def synthetic_prompt(rng):
+    return f"A {rng.choice(SUBJECTS)} {rng.choice(ACTIONS)} {rng.choice(OBJECTS)} in a {rng.choice(['kitchen', 'office', 'park', 'classroom', 'spaceship'])}, {rng.choice(STYLES)}, {rng.randrange(100000)}"
+
+def main():
+    log_path = sys.argv[1] if len(sys.argv) > 1 else "log.txt"
+    threshold = float(sys.argv[2]) if len(sys.argv) > 2 else 0.6
+    rng = random.Random(1)
+
+    logged = read_logged_prompts(log_path)
+    with_siblings = [variant for prompt in logged for variant in [prompt] + sibling_prompts(prompt, rng)]
+
+    print(f"Similarity threshold {threshold}\n")
+    for label, prompts in (("logged prompts", logged), ("logged prompts + siblings", with_siblings)):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            api_calls, timings = replay(ImagePromptIndex(temp_dir), prompts, threshold)
+        saved = len(prompts) - api_calls
+        print(f"{label:<27} {len(prompts):5d} prompts   {api_calls:5d} image API calls   {saved:5d} saved ({saved / len(prompts):.0%})   lookup median {statistics.median(timings)*1000:.3f} ms")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        index = ImagePromptIndex(temp_dir)
+        start = time.perf_counter()
+        for _ in range(SYNTHETIC_ENTRIES):
+            index.add(synthetic_prompt(rng), b"image")
+        print(f"\nIndexed {SYNTHETIC_ENTRIES:,} synthetic prompts in {time.perf_counter() - start:.1f} s")
+
+        timings = []
+        for _ in range(1000):
+            start = time.perf_counter()
+            index.find(synthetic_prompt(rng), threshold)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        print(f"Lookup against {len(index):,} entries:  median {statistics.median(timings)*1000:.3f} ms   p99 {timings[int(len(timings) * 0.99)]*1000:.3f} ms")
+
+        start = time.perf_counter()
+        ImagePromptIndex(temp_dir)
+        print(f"Reloading the persisted index took {time.perf_counter() - start:.2f} s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# Load benchmark for the SQLite meme store
+# Fills a fresh database with a large meme history, measures history page latency (first page and deep keyset pages),
+# then runs several worker processes against the same database at once to check WAL-mode reads and writes across processes.
+# Run from the project folder:   python benchmarks/meme_store_load.py [total_memes] [worker_processes]
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from meme_store import MemeStore
+
+USERS = 1000
+HEAVY_USER = "heavy@example.com"  # Gets a tenth of all memes, to test deep pagination
+WORKER_SECONDS = 5
+
+def fill(db_path, total_memes):
+    store = MemeStore(db_path)
+    for i in range(USERS):
+        store.create_user(f"user{i}@example.com", f"User {i}", "hash")
+    store.create_user(HEAVY_USER, "Heavy User", "hash")
+
+    conn = store._connection()
+    user_ids = [row[0] for row in conn.execute("SELECT id FROM users")]
+    heavy_id = conn.execute("SELECT id FROM users WHERE email = ?", (HEAVY_USER,)).fetchone()[0]
+    now = time.time()
+    batch = []
+    with conn:
+        for i in range(total_memes):
+            user_id = heavy_id if i % 10 == 0 else random.choice(user_ids)
+            batch.append((user_id, f"prompt {i}", f"meme text {i}", f"image prompt {i}", now))
+            if len(batch) == 50000:
+                conn.executemany("INSERT INTO memes (user_id, prompt, meme_text, image_prompt, created_at) VALUES (?, ?, ?, ?, ?)", batch)
+                batch.clear()
+        conn.executemany("INSERT INTO memes (user_id, prompt, meme_text, image_prompt, created_at) VALUES (?, ?, ?, ?, ?)", batch)
+    return store
+
+def time_pages(store, email, pages):
+    timings = []
+    before_id = None
+    for _ in range(pages):
+        start = time.perf_counter()
+        memes, before_id = store.get_history(email, before_id=before_id, limit=20)
+        timings.append(time.perf_counter() - start)
+        if before_id is None:
+            break
+    return timings
+
+def worker(db_path, worker_number, results):
+    store = MemeStore(db_path)
+    reads = writes = 0
+    deadline = time.time() + WORKER_SECONDS
+    while time.time() < deadline:
+        email = f"user{random.randrange(USERS)}@example.com"
+        if random.random() < 0.2:
+            store.add_meme(email, f"worker {worker_number} prompt", "text", "image prompt")
+            writes += 1
+        else:
+            store.get_history(email, limit=20)
+            reads += 1
+    results.put((reads, writes))
+
+def main():
+    total_memes = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    worker_processes = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, "memes.db")
+
+        start = time.perf_counter()
+        store = fill(db_path, total_memes)
+        print(f"Inserted {total_memes:,} memes for {USERS + 1} users in {time.perf_counter() - start:.1f} s")
+
+        first_pages = [time_pages(store, f"user{random.randrange(USERS)}@example.com", 1)[0] for _ in range(500)]
+        print(f"First history page (random user):  median {statistics.median(first_pages)*1e6:8.1f} us   max {max(first_pages)*1e6:8.1f} us")
+
+        heavy_pages = time_pages(store, HEAVY_USER, 2000)
+        print(f"Paging {len(heavy_pages)} pages deep ({store.count_memes(HEAVY_USER):,} memes):  median {statistics.median(heavy_pages)*1e6:8.1f} us   last page {heavy_pages[-1]*1e6:8.1f} us")
+        store.close()
+
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=worker, args=(db_path, i, results)) for i in range(worker_processes)]
+        for process in processes:
+            process.start()
+        totals = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        reads = sum(r for r, w in totals)
+        writes = sum(w for r, w in totals)
+        print(f"{worker_processes} processes for {WORKER_SECONDS} s:  {reads / WORKER_SECONDS:,.0f} history reads/s   {writes / WORKER_SECONDS:,.0f} meme writes/s")
+
+if __name__ == "__main__":
+    main()
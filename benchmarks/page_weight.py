@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# Page weight benchmark for the web app's response layer
+# Logs in with the Flask test client and requests each page and JSON endpoint three ways: without compression, compressed, and as a repeat view
+# sending back the ETag it got. Prints bytes on the wire and server time for each, and checks static files get a fingerprinted, long-lived URL.
+# Then estimates time to first render of the login page with the prebuilt Tailwind stylesheet and with the in-browser CDN compiler, from the
+# render-blocking requests and bytes in its <head> on a throttled mobile connection. The estimate leaves out script run time, so for the CDN compiler it is a lower bound.
+# Run from the project folder:   python benchmarks/page_weight.py
+import os
+import shutil
+import sys
+import tempfile
+import time
+import urllib.request
+from contextlib import redirect_stdout
+from html.parser import HTMLParser
+from io import StringIO
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_DIR)
+sys.argv = sys.argv[:1]
+os.chdir(REPO_DIR)
+os.environ.setdefault("MEME_DB_PATH", os.path.join(tempfile.mkdtemp(), "memes.db"))
+
+with redirect_stdout(StringIO()):
+    import app as web_app
+
+PAGES = ["/", "/profile", "/about", "/api/user", "/api/history?limit=100"]
+REPEATS = 20
+# Lighthouse's mobile throttling: 150 ms round trips and 1.6 Mbps down. A new HTTPS origin costs 3 round trips (DNS, TCP, TLS) before its first request
+RTT_SECONDS = 0.150
+BYTES_PER_SECOND = 1.6e6 / 8
+NEW_ORIGIN_ROUND_TRIPS = 3
+
+# Collects the stylesheets and synchronous scripts in <head>, which the browser must load before it renders anything
+class RenderBlockingParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.in_head = True
+        self.urls = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "body":
+            self.in_head = False
+        if not self.in_head:
+            return
+        if tag == "link" and attrs.get("rel") == "stylesheet" and attrs.get("media", "all") in ("all", "screen"):
+            self.urls.append(attrs["href"])
+        elif tag == "script" and attrs.get("src") and "async" not in attrs and "defer" not in attrs and attrs.get("type") != "module":
+            self.urls.append(attrs["src"])
+
+_external_sizes = {}
+
+# Returns the compressed size of an external file, or None if it can't be fetched from here
+def external_size(url):
+    if url not in _external_sizes:
+        try:
+            request = urllib.request.Request(url, headers={"Accept-Encoding": "gzip, br"})
+            with urllib.request.urlopen(request, timeout=5) as response:
+                _external_sizes[url] = len(response.read())
+        except OSError:
+            _external_sizes[url] = None
+    return _external_sizes[url]
+
+# Estimates time to first render: the HTML, then every render-blocking file in parallel (sharing the bandwidth), each one round trip
+# plus the connection setup for origins other than the page's own. Files that can't be fetched are counted by request only
+def time_to_first_render(client, path):
+    page = client.get(path, headers={"Accept-Encoding": "gzip, br"})
+    parser = RenderBlockingParser()
+    parser.feed(client.get(path, headers={"Accept-Encoding": "identity"}).get_data(as_text=True))
+    blocking_bytes, round_trips, unmeasured = 0, 1, []
+    for url in parser.urls:
+        if url.startswith("/"):
+            response = client.get(url, headers={"Accept-Encoding": "gzip, br"})
+            blocking_bytes += len(response.data)
+            response.close()
+        else:
+            round_trips = max(round_trips, 1 + NEW_ORIGIN_ROUND_TRIPS)
+            size = external_size(url)
+            if size is None:
+                unmeasured.append(url)
+            else:
+                blocking_bytes += size
+    seconds = RTT_SECONDS + len(page.data) / BYTES_PER_SECOND + round_trips * RTT_SECONDS + blocking_bytes / BYTES_PER_SECOND
+    return len(parser.urls), len(page.data) + blocking_bytes, seconds, unmeasured
+
+def timed_get(client, path, headers):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        response = client.get(path, headers=headers)
+    return response, (time.perf_counter() - start) / REPEATS * 1000
+
+def main():
+    flask_app = web_app.app
+    # The templates live in the project folder
+    flask_app.template_folder = REPO_DIR
+    # Registered last, so it overrides the app's own choice of stylesheet when the CDN compiler is measured
+    use_cdn = {"value": False}
+    flask_app.context_processor(lambda: {"prebuilt_tailwind": False} if use_cdn["value"] else {})
+
+    for i in range(100):
+        web_app.store.add_meme("test@example.com", f"benchmark prompt {i}", f"top text {i}|bottom text {i}", f"an image prompt describing scene number {i}")
+
+    client = flask_app.test_client()
+    client.post("/login", json={"email": "test@example.com", "password": "password123"})
+
+    print(f"{'path':<26}{'plain bytes':>12}{'compressed':>12}{'repeat view':>13}{'plain ms':>10}{'comp. ms':>10}")
+    total_plain, total_compressed = 0, 0
+    for path in PAGES:
+        plain, plain_ms = timed_get(client, path, {"Accept-Encoding": "identity"})
+        compressed, compressed_ms = timed_get(client, path, {"Accept-Encoding": "gzip, br"})
+        repeat = client.get(path, headers={"Accept-Encoding": "gzip, br", "If-None-Match": compressed.headers.get("ETag", "")})
+        total_plain += len(plain.data)
+        total_compressed += len(compressed.data)
+        print(f"{path:<26}{len(plain.data):>12}{len(compressed.data):>12}{f'{repeat.status_code} / {len(repeat.data)}B':>13}{plain_ms:>10.2f}{compressed_ms:>10.2f}"
+              f"  [{compressed.headers.get('Content-Encoding', 'none')}]")
+    print(f"\nTotal for one view of every page: {total_plain} bytes plain, {total_compressed} bytes compressed ({total_compressed / total_plain:.0%})")
+
+    # Static files are linked with a content hash and served with a long max-age
+    static_dir = flask_app.static_folder
+    created_static_dir = not os.path.isdir(static_dir)
+    test_file = os.path.join(static_dir, "css", "page_weight_benchmark.css")
+    os.makedirs(os.path.dirname(test_file), exist_ok=True)
+    try:
+        with open(test_file, "w") as css_file:
+            css_file.write(".benchmark { color: #fff; }\n" * 200)
+        with flask_app.test_request_context():
+            url = web_app.url_for("static", filename="css/page_weight_benchmark.css")
+        response = client.get(url, headers={"Accept-Encoding": "gzip"})
+        print(f"\nStatic URL: {url}")
+        print(f"  Cache-Control: {response.headers.get('Cache-Control')}")
+        print(f"  {os.path.getsize(test_file)} bytes on disk, {len(response.data)} bytes sent ({response.headers.get('Content-Encoding', 'none')})")
+        response.close()
+    finally:
+        os.remove(test_file)
+        if created_static_dir:
+            shutil.rmtree(static_dir)
+
+    print(f"\nTime to first render of /login ({RTT_SECONDS*1000:.0f} ms round trips, {BYTES_PER_SECOND*8/1e6:.1f} Mbps):")
+    client.post("/logout")
+    for label, cdn in (("prebuilt stylesheet", False), ("CDN compiler", True)):
+        use_cdn["value"] = cdn
+        requests, total_bytes, seconds, unmeasured = time_to_first_render(client, "/login")
+        # Without the size of every file the estimate is only a lower bound
+        estimate = f"{'>=' if unmeasured else '~ '}{seconds*1000:5.0f} ms"
+        print(f"  {label:<20} {requests} render-blocking requests   {total_bytes:>8} bytes   {estimate}")
+        for url in unmeasured:
+            print(f"  {'':<20} not reachable from here, counted without its size: {url}")
+
+if __name__ == "__main__":
+    main()
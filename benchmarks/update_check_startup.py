@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# Benchmark for the update check's effect on startup
+# GitHub is replaced by a stub with a fixed delay (or a hang until the timeout, to mimic being offline),
+# and the time generate() would spend on the update check before the user can type a prompt is measured for each case.
+# Run from the project folder:   python benchmarks/update_check_startup.py
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.argv = sys.argv[:1]  # AIMemeGenerator parses the command line when imported
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import AIMemeGenerator
+
+GITHUB_LATENCY = 0.8  # Seconds for a normal GitHub API response
+RELEASES = [{"name": "1.0.5", "prerelease": False}] * 10
+
+class StubResponse:
+    status_code = 200
+    def json(self):
+        return RELEASES
+
+def stub_get_online(url, timeout=None):
+    time.sleep(GITHUB_LATENCY)
+    return StubResponse()
+
+def stub_get_offline(url, timeout=None):
+    time.sleep(timeout)
+    raise OSError("timed out")
+
+def measure(label, start_check):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = start_check()
+    print(f"{label:<45} {(time.perf_counter() - start)*1000:8.1f} ms")
+    return result
+
+def main():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.chdir(temp_dir)
+        check = lambda: AIMemeGenerator.check_for_update(AIMemeGenerator.version, "all", silentCheck=True)
+        background = lambda: AIMemeGenerator.start_background_update_check(AIMemeGenerator.version, "all")
+
+        print("Time before the prompt can be shown:\n")
+        AIMemeGenerator.requests.get = stub_get_online
+        measure("blocking check, no cache (online)", check)
+        measure("blocking check, cached", check)
+        os.remove(AIMemeGenerator.UPDATE_CHECK_CACHE_FILE)
+        measure("background check, no cache (online)", background).result()
+        os.remove(AIMemeGenerator.UPDATE_CHECK_CACHE_FILE)
+
+        AIMemeGenerator.requests.get = stub_get_offline
+        measure(f"blocking check, no cache (offline, {AIMemeGenerator.UPDATE_CHECK_TIMEOUT} s timeout)", check)
+        measure("background check, no cache (offline)", background)
+
+if __name__ == "__main__":
+    main()
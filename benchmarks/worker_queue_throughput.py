@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# Throughput and crash recovery benchmark for worker mode
+# Queues a batch of generation jobs and drains them with 1, 2, 4 and 8 worker processes sharing one SQLite job queue and meme store.
+# Generation is replaced by a stub that sleeps like a provider call and does a little CPU work like rendering, so the numbers show the
+# queue's overhead and how throughput scales with workers. A last run kills a worker in the middle of its jobs, and checks every job
+# is still finished exactly once after its lease expires.
+# Run from the project folder:   python benchmarks/worker_queue_throughput.py [jobs]
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from io import StringIO
+
+sys.argv = sys.argv[:1]  # AIMemeGenerator parses the command line when imported
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+with redirect_stdout(StringIO()):
+    import worker
+from job_queue import SQLiteJobQueue
+from meme_store import MemeStore
+
+USER = "bench@example.com"
+PROVIDER_SECONDS = 0.05
+LEASE_SECONDS = 1.0
+
+def stub_generate(prompt):
+    time.sleep(random.uniform(0.5, 1.5) * PROVIDER_SECONDS)
+    sum(i * i for i in range(20000))
+    return {'png': b"\x89PNG" + prompt.encode('utf-8'), 'meme_text': f"text for {prompt}", 'image_prompt': f"image for {prompt}"}
+
+# Dies partway through its third job, like a worker machine going down
+def crashing_generate(prompt, calls=[0]):
+    calls[0] += 1
+    if calls[0] == 3:
+        os._exit(1)
+    return stub_generate(prompt)
+
+def run_worker_process(queue_path, db_path, worker_id, crash):
+    queue = SQLiteJobQueue(queue_path, lease_seconds=LEASE_SECONDS)
+    store = MemeStore(db_path)
+    stop_event = threading.Event()
+    generate_one = crashing_generate if crash else stub_generate
+    with redirect_stdout(StringIO()):
+        # Stop once the queue stays empty
+        while True:
+            job = queue.claim(worker_id)
+            if job is None:
+                stats = queue.get_stats()
+                if stats['queued'] == 0 and stats['running'] == 0:
+                    return
+                stop_event.wait(0.05)
+                continue
+            worker.process_job(queue, store, job, worker_id, generate_one)
+
+def run(jobs, worker_processes, crash=False):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        queue_path = os.path.join(temp_dir, "jobs.db")
+        db_path = os.path.join(temp_dir, "memes.db")
+        queue = SQLiteJobQueue(queue_path, lease_seconds=LEASE_SECONDS)
+        store = MemeStore(db_path)
+        store.create_user(USER, "Bench", "hash")
+        for i in range(jobs):
+            queue.enqueue(f"job-{i}", {'prompt': f"prompt {i}", 'user': USER})
+        # Enqueueing the same ids again must not add jobs
+        for i in range(jobs):
+            queue.enqueue(f"job-{i}", {'prompt': f"prompt {i}", 'user': USER})
+
+        start = time.perf_counter()
+        processes = [multiprocessing.Process(target=run_worker_process, args=(queue_path, db_path, f"worker-{n}", crash and n == 0)) for n in range(worker_processes)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        stats = queue.get_stats()
+        memes = store.count_memes(USER)
+        retried = queue._connection().execute("SELECT COUNT(*) FROM jobs WHERE attempts > 1").fetchone()[0]
+        return elapsed, stats, memes, retried
+
+def main():
+    jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print(f"{jobs} jobs, about {PROVIDER_SECONDS * 1000:.0f} ms of provider time each")
+    baseline = None
+    for worker_processes in (1, 2, 4, 8):
+        elapsed, stats, memes, _ = run(jobs, worker_processes)
+        baseline = baseline or elapsed
+        print(f"{worker_processes} workers:  {jobs / elapsed:7.1f} jobs/s   {baseline / elapsed:4.1f}x   done {stats['done']}  failed {stats['failed']}  memes saved {memes}")
+
+    elapsed, stats, memes, retried = run(jobs, 4, crash=True)
+    print(f"\n4 workers, one killed mid-job:  {jobs / elapsed:7.1f} jobs/s   done {stats['done']}  failed {stats['failed']}  memes saved {memes}  "
+          f"jobs retried after lease expiry {retried}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+# Image Prompt Index
+# Finds past image prompts that are near-duplicates of a new one, so the image generated for them can be reused instead of paying for another image generation.
+# Prompts are normalized into word and word-pair shingles, and a MinHash signature of the shingles is put into LSH band buckets, so a lookup only compares
+# against the few past prompts that share a bucket. Candidates are then checked with the exact Jaccard similarity of their shingles.
+# The index and the reusable images are persisted to a folder, and the index is rebuilt in memory from it on startup.
+# The index can be capped by entry count and entry age. The oldest entries are evicted first, and their images deleted, so the folder doesn't grow forever.
+
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+
+NUM_PERMUTATIONS = 64
+BANDS = 16                      # NUM_PERMUTATIONS must divide evenly into bands
+ROWS_PER_BAND = NUM_PERMUTATIONS // BANDS
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 64) - 1
+
+# Words that don't change what an image shows
+STOP_WORDS = {"a", "an", "the", "of", "with", "and", "in", "on", "at", "to", "is", "its", "their", "his", "her"}
+
+# Same permutations in every process, so persisted signatures stay valid
+_permutation_random = random.Random(1)
+PERMUTATIONS = [(_permutation_random.randrange(1, MERSENNE_PRIME), _permutation_random.randrange(0, MERSENNE_PRIME)) for _ in range(NUM_PERMUTATIONS)]
+
+def get_shingles(prompt):
+    words = [word for word in re.findall(r"[a-z0-9']+", prompt.lower()) if word not in STOP_WORDS]
+    shingles = set(words)
+    shingles.update(f"{first} {second}" for first, second in zip(words, words[1:]))
+    return shingles
+
+def get_signature(shingles):
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'little') for shingle in shingles]
+    if not hashes:
+        return [MAX_HASH] * NUM_PERMUTATIONS
+    return [min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in PERMUTATIONS]
+
+def jaccard_similarity(first_shingles, second_shingles):
+    if not first_shingles or not second_shingles:
+        return 0.0
+    return len(first_shingles & second_shingles) / len(first_shingles | second_shingles)
+
+def get_band_keys(signature):
+    return [(band, tuple(signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND])) for band in range(BANDS)]
+
+class ImagePromptIndex:
+    # A max_entries or max_age_seconds of 0 means no limit
+    def __init__(self, index_folder, max_entries=0, max_age_seconds=0):
+        self.index_folder = index_folder
+        self.images_folder = os.path.join(index_folder, "images")
+        self.index_file_path = os.path.join(index_folder, "index.jsonl")
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        # Entry id -> (prompt, shingles, signature, added_at), oldest first
+        self._entries = OrderedDict()
+        self._buckets = {}
+        self._stale_index_lines = 0
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+        self.lookup_seconds = 0.0
+
+        os.makedirs(self.images_folder, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.index_file_path):
+            return
+        with open(self.index_file_path, "r", encoding='utf-8') as index_file:
+            for line in index_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                image_path = self._image_path(entry['id'])
+                if not os.path.isfile(image_path) or entry['id'] in self._entries:
+                    self._stale_index_lines += 1
+                else:
+                    # Entries written before added_at was recorded are dated by their image file
+                    self._insert(entry['id'], entry['prompt'], entry['signature'], entry.get('added_at') or os.path.getmtime(image_path))
+        with self._lock:
+            self._evict()
+
+    def _image_path(self, entry_id):
+        return os.path.join(self.images_folder, f"{entry_id}.png")
+
+    def _insert(self, entry_id, prompt, signature, added_at):
+        self._entries[entry_id] = (prompt, get_shingles(prompt), signature, added_at)
+        for band_key in get_band_keys(signature):
+            self._buckets.setdefault(band_key, set()).add(entry_id)
+
+    def _remove(self, entry_id):
+        prompt, shingles, signature, added_at = self._entries.pop(entry_id)
+        for band_key in get_band_keys(signature):
+            bucket = self._buckets[band_key]
+            bucket.discard(entry_id)
+            if not bucket:
+                del self._buckets[band_key]
+        try:
+            os.remove(self._image_path(entry_id))
+        except OSError:
+            pass
+
+    # Drops the oldest entries until the index is within its limits. Called with the lock held
+    def _evict(self):
+        oldest_allowed = time.time() - self.max_age_seconds if self.max_age_seconds > 0 else None
+        while self._entries:
+            entry_id, (prompt, shingles, signature, added_at) = next(iter(self._entries.items()))
+            if not (self.max_entries > 0 and len(self._entries) > self.max_entries) and not (oldest_allowed is not None and added_at < oldest_allowed):
+                break
+            self._remove(entry_id)
+            self.evictions += 1
+            self._stale_index_lines += 1
+        # The index file only grows, so it is rewritten without the evicted entries once they make up about half of it
+        if self._stale_index_lines > max(len(self._entries), 100):
+            self._rewrite_index_file()
+
+    # Other processes may share the folder and append entries this one hasn't loaded, so every line whose image still exists is kept, not just this process's entries
+    def _rewrite_index_file(self):
+        kept_lines, kept_ids = [], set()
+        with open(self.index_file_path, "r", encoding='utf-8') as index_file:
+            for line in index_file:
+                try:
+                    entry_id = json.loads(line)['id']
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    continue
+                if entry_id not in kept_ids and os.path.isfile(self._image_path(entry_id)):
+                    kept_ids.add(entry_id)
+                    kept_lines.append(line if line.endswith("\n") else line + "\n")
+        temp_path = f"{self.index_file_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding='utf-8') as index_file:
+            index_file.writelines(kept_lines)
+        os.replace(temp_path, self.index_file_path)
+        self._stale_index_lines = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Returns (image bytes, matched prompt, similarity) for the most similar past prompt at or above the threshold, or None
+    def find(self, prompt, threshold):
+        start = time.perf_counter()
+        shingles = get_shingles(prompt)
+        signature = get_signature(shingles)
+
+        best_id, best_similarity = None, threshold
+        with self._lock:
+            self._evict()
+            candidates = {entry_id for band_key in get_band_keys(signature) for entry_id in self._buckets.get(band_key, ())}
+            for entry_id in candidates:
+                similarity = jaccard_similarity(shingles, self._entries[entry_id][1])
+                if similarity >= best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+            best_prompt = self._entries[best_id][0] if best_id else None
+
+        result = None
+        if best_id is not None:
+            try:
+                with open(self._image_path(best_id), "rb") as image_file:
+                    result = (image_file.read(), best_prompt, best_similarity)
+            except OSError:
+                result = None
+
+        with self._lock:
+            self.lookups += 1
+            self.hits += result is not None
+            self.lookup_seconds += time.perf_counter() - start
+        return result
+
+    # Adds a generated image under its prompt and persists it
+    def add(self, prompt, image_bytes):
+        signature = get_signature(get_shingles(prompt))
+        entry_id = hashlib.sha1(prompt.encode('utf-8') + image_bytes[:4096]).hexdigest()[:16]
+        with open(self._image_path(entry_id), "wb") as image_file:
+            image_file.write(image_bytes)
+        with self._lock:
+            if entry_id in self._entries:
+                return entry_id
+            added_at = time.time()
+            with open(self.index_file_path, "a", encoding='utf-8') as index_file:
+                index_file.write(json.dumps({"id": entry_id, "prompt": prompt, "signature": signature, "added_at": added_at}) + "\n")
+            self._insert(entry_id, prompt, signature, added_at)
+            self._evict()
+        return entry_id
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "average_lookup_ms": self.lookup_seconds / self.lookups * 1000 if self.lookups else 0.0
+            }
@@ -0,0 +1,137 @@
+# Job Queue
+# Durable queue of meme generation jobs, so web front-ends only enqueue work and separate worker processes (see worker.py) do the generating.
+# This local implementation is a SQLite file in WAL mode, shared by every front-end and worker that can reach it. Anything with the same methods
+# (enqueue, claim, extend_lease, complete, fail, get_job, wait_for_job, get_stats) can replace it, e.g. a Redis-backed queue for several machines.
+#
+# Jobs are claimed with a lease. A worker that is still running a job extends its lease, and a worker that crashes simply stops extending it,
+# so once the lease expires the job is handed to the next worker that asks. Each claim counts as an attempt, and a job that has used up its
+# attempts is marked failed instead of being retried forever. A job deferred with defer() (e.g. because its provider's circuit is open) gets
+# its attempt back, so waiting out an outage never uses up its retries. Job ids are chosen by the caller, so enqueueing the same id twice gives back the
+# existing job instead of generating the meme again.
+
+import json
+import time
+
+from sqlite_database import SQLiteDatabase
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker_id TEXT,
+    available_at REAL NOT NULL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_available_at ON jobs (status, available_at);
+"""
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# available_at is when the job can next be claimed: for a queued job when it was queued (or its retry delay ends), for a running job when its lease expires
+INSERT_JOB = "INSERT OR IGNORE INTO jobs (id, payload, status, available_at, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?, ?)"
+SELECT_JOB = "SELECT id, payload, status, attempts, worker_id, available_at, result, error, created_at, updated_at FROM jobs WHERE id = ?"
+SELECT_CLAIMABLE = "SELECT id, status, attempts FROM jobs WHERE status IN ('queued', 'running') AND available_at <= ? ORDER BY available_at LIMIT 1"
+CLAIM_JOB = "UPDATE jobs SET status = 'running', attempts = attempts + 1, worker_id = ?, available_at = ?, error = NULL, updated_at = ? WHERE id = ?"
+EXPIRE_JOB = "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ?"
+EXTEND_LEASE = "UPDATE jobs SET available_at = ?, updated_at = ? WHERE id = ? AND worker_id = ? AND status = 'running'"
+COMPLETE_JOB = "UPDATE jobs SET status = 'done', result = ?, updated_at = ? WHERE id = ? AND worker_id = ? AND status = 'running'"
+RETRY_JOB = "UPDATE jobs SET status = 'queued', available_at = ?, error = ?, updated_at = ? WHERE id = ? AND worker_id = ? AND status = 'running'"
+DEFER_JOB = "UPDATE jobs SET status = 'queued', attempts = attempts - 1, available_at = ?, error = ?, updated_at = ? WHERE id = ? AND worker_id = ? AND status = 'running'"
+FAIL_JOB = "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ? AND worker_id = ? AND status = 'running'"
+COUNT_JOBS = "SELECT status, COUNT(*) AS count FROM jobs GROUP BY status"
+
+# Transactions are started explicitly (isolation_level=None), so claiming can take the write lock before it reads
+class SQLiteJobQueue(SQLiteDatabase):
+    def __init__(self, db_path="jobs.db", lease_seconds=60.0, max_attempts=3, busy_timeout=5.0):
+        super().__init__(db_path, busy_timeout, isolation_level=None)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._connection().executescript(SCHEMA)
+
+    def _row_to_job(self, row):
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    # Adds a job and returns it. If a job with this id already exists, nothing is added and the existing job is returned
+    def enqueue(self, job_id, payload):
+        now = time.time()
+        conn = self._connection()
+        conn.execute(INSERT_JOB, (job_id, json.dumps(payload), now, now, now))
+        return self._row_to_job(conn.execute(SELECT_JOB, (job_id,)).fetchone())
+
+    def get_job(self, job_id):
+        row = self._connection().execute(SELECT_JOB, (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    # Leases the oldest job that is queued, or whose previous worker's lease expired, to the worker. Returns the job or None if there is nothing to do
+    def claim(self, worker_id):
+        conn = self._connection()
+        while True:
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(SELECT_CLAIMABLE, (now,)).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                # A job whose worker kept dying has used up its attempts
+                if row["status"] == JOB_RUNNING and row["attempts"] >= self.max_attempts:
+                    conn.execute(EXPIRE_JOB, (f"Lease expired after {row['attempts']} attempts", now, row["id"]))
+                    conn.execute("COMMIT")
+                    continue
+                conn.execute(CLAIM_JOB, (worker_id, now + self.lease_seconds, now, row["id"]))
+                job = conn.execute(SELECT_JOB, (row["id"],)).fetchone()
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            return self._row_to_job(job)
+
+    # Keeps the job leased to the worker for another lease period. Returns False if the worker no longer holds the lease
+    def extend_lease(self, job_id, worker_id):
+        now = time.time()
+        return self._connection().execute(EXTEND_LEASE, (now + self.lease_seconds, now, job_id, worker_id)).rowcount > 0
+
+    # Records the job's result. Returns False if the worker's lease had expired and the job went to another worker
+    def complete(self, job_id, worker_id, result):
+        return self._connection().execute(COMPLETE_JOB, (json.dumps(result), time.time(), job_id, worker_id)).rowcount > 0
+
+    # Records a failed attempt. The job is queued again after retry_delay seconds while it has attempts left, and marked failed otherwise.
+    # Pass retry_delay=None for errors that retrying won't fix
+    def fail(self, job_id, worker_id, error, retry_delay=0.0):
+        conn = self._connection()
+        now = time.time()
+        job = self.get_job(job_id)
+        if job is not None and job["attempts"] < self.max_attempts and retry_delay is not None:
+            return conn.execute(RETRY_JOB, (now + retry_delay, str(error), now, job_id, worker_id)).rowcount > 0
+        return conn.execute(FAIL_JOB, (str(error), now, job_id, worker_id)).rowcount > 0
+
+    # Queues the job again after retry_delay seconds without counting the attempt, for jobs that couldn't start rather than failed
+    def defer(self, job_id, worker_id, reason, retry_delay):
+        now = time.time()
+        return self._connection().execute(DEFER_JOB, (now + retry_delay, str(reason), now, job_id, worker_id)).rowcount > 0
+
+    # Polls until the job is done or failed, and returns it. Returns the job as it is if the timeout passes first
+    def wait_for_job(self, job_id, timeout=120.0, poll_interval=0.1):
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get_job(job_id)
+            if job is None or job["status"] in (JOB_DONE, JOB_FAILED) or time.monotonic() >= deadline:
+                return job
+            time.sleep(min(poll_interval, max(deadline - time.monotonic(), 0)))
+
+    def get_stats(self):
+        counts = {JOB_QUEUED: 0, JOB_RUNNING: 0, JOB_DONE: 0, JOB_FAILED: 0}
+        for row in self._connection().execute(COUNT_JOBS):
+            counts[row["status"]] = row["count"]
+        return counts
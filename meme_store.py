@@ -0,0 +1,183 @@
+# Meme Store
+# SQLite-backed storage for user accounts and per-user meme history, shared by every web worker process on the machine.
+# Connections come from SQLiteDatabase (WAL mode, one connection per thread, see sqlite_database.py) and reuse the prepared statements below.
+# History is paged with keyset pagination on (user_id, id), so loading any page costs the same no matter how many memes a user has.
+# Meme images are saved as PNG files in a folder next to the database, and SQLite only keeps their paths, so the database stays small.
+
+import os
+import sqlite3
+import time
+
+from sqlite_database import SQLiteDatabase
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    email TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    password_hash TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS memes (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    prompt TEXT NOT NULL,
+    meme_text TEXT,
+    image_prompt TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS memes_user_id_id ON memes (user_id, id);
+CREATE TABLE IF NOT EXISTS meme_images (
+    meme_id INTEGER PRIMARY KEY REFERENCES memes(id) ON DELETE CASCADE,
+    png BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meme_image_files (
+    meme_id INTEGER PRIMARY KEY REFERENCES memes(id) ON DELETE CASCADE,
+    path TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pregeneration_spend (
+    id INTEGER PRIMARY KEY,
+    spent_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pregeneration_spend_spent_at ON pregeneration_spend (spent_at);
+"""
+
+# meme_images holds the PNG bytes of memes saved before images moved to files. It is only read now, and its rows go away with their memes
+SELECT_USER = "SELECT id, email, name, password_hash, created_at FROM users WHERE email = ?"
+INSERT_USER = "INSERT INTO users (email, name, password_hash, created_at) VALUES (?, ?, ?, ?)"
+INSERT_MEME = "INSERT INTO memes (user_id, prompt, meme_text, image_prompt, created_at) SELECT id, ?, ?, ?, ? FROM users WHERE email = ?"
+INSERT_MEME_IMAGE_FILE = "INSERT INTO meme_image_files (meme_id, path) VALUES (?, ?)"
+SELECT_HISTORY_FIRST_PAGE = "SELECT m.id, m.prompt, m.meme_text, m.image_prompt, m.created_at FROM memes m JOIN users u ON u.id = m.user_id WHERE u.email = ? ORDER BY m.id DESC LIMIT ?"
+SELECT_HISTORY_PAGE = "SELECT m.id, m.prompt, m.meme_text, m.image_prompt, m.created_at FROM memes m JOIN users u ON u.id = m.user_id WHERE u.email = ? AND m.id < ? ORDER BY m.id DESC LIMIT ?"
+SELECT_MEME_IMAGE = "SELECT f.path, i.png FROM memes m JOIN users u ON u.id = m.user_id LEFT JOIN meme_image_files f ON f.meme_id = m.id LEFT JOIN meme_images i ON i.meme_id = m.id WHERE m.id = ? AND u.email = ?"
+SELECT_MEME_IMAGE_FILE = "SELECT f.path FROM meme_image_files f JOIN memes m ON m.id = f.meme_id JOIN users u ON u.id = m.user_id WHERE m.id = ? AND u.email = ?"
+SELECT_HISTORY_IMAGE_FILES = "SELECT f.path FROM meme_image_files f JOIN memes m ON m.id = f.meme_id JOIN users u ON u.id = m.user_id WHERE u.email = ?"
+DELETE_MEME = "DELETE FROM memes WHERE id = ? AND user_id = (SELECT id FROM users WHERE email = ?)"
+DELETE_HISTORY = "DELETE FROM memes WHERE user_id = (SELECT id FROM users WHERE email = ?)"
+COUNT_MEMES = "SELECT COUNT(*) FROM memes m JOIN users u ON u.id = m.user_id WHERE u.email = ?"
+# One statement, so checking the budget and spending from it can't interleave with another process doing the same
+INSERT_PREGENERATION_SPEND = "INSERT INTO pregeneration_spend (spent_at) SELECT ? WHERE (SELECT COUNT(*) FROM pregeneration_spend WHERE spent_at >= ?) < ?"
+COUNT_PREGENERATION_SPEND = "SELECT COUNT(*) FROM pregeneration_spend WHERE spent_at >= ?"
+DELETE_OLD_PREGENERATION_SPEND = "DELETE FROM pregeneration_spend WHERE spent_at < ?"
+
+MAX_PAGE_SIZE = 100
+IMAGES_PER_FOLDER = 1000  # Image files are split into subfolders by meme id, so no single folder grows too large
+
+class MemeStore(SQLiteDatabase):
+    # images_folder defaults to a folder named after the database, e.g. memes_images/ for memes.db
+    def __init__(self, db_path="memes.db", busy_timeout=5.0, images_folder=None):
+        super().__init__(db_path, busy_timeout, pragmas=("PRAGMA foreign_keys=ON",))
+        self.images_folder = images_folder or os.path.splitext(db_path)[0] + "_images"
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+    # ------------ IMAGE FILES ------------
+    # Paths are stored relative to images_folder, so the folder can be moved together with the database
+
+    def _write_image(self, meme_id, png):
+        relative_path = os.path.join(str(meme_id // IMAGES_PER_FOLDER), f"{meme_id}.png")
+        file_path = os.path.join(self.images_folder, relative_path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        # Write to a temporary name first so a reader never sees a half-written image
+        temp_path = f"{file_path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(png)
+        os.replace(temp_path, file_path)
+        return relative_path
+
+    def _read_image(self, relative_path):
+        try:
+            with open(os.path.join(self.images_folder, relative_path), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _remove_images(self, relative_paths):
+        for relative_path in relative_paths:
+            try:
+                os.remove(os.path.join(self.images_folder, relative_path))
+            except FileNotFoundError:
+                pass
+
+    # ------------ USERS ------------
+
+    def get_user(self, email):
+        row = self._connection().execute(SELECT_USER, (email,)).fetchone()
+        return dict(row) if row else None
+
+    # Returns False if the email is already registered
+    def create_user(self, email, name, password_hash):
+        try:
+            with self._connection() as conn:
+                conn.execute(INSERT_USER, (email, name, password_hash, time.time()))
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    # ------------ MEME HISTORY ------------
+
+    # Records a generated meme for the user and returns its id. The PNG bytes are optional.
+    # The image file is written inside the transaction, so if writing it fails the meme is not recorded either
+    def add_meme(self, email, prompt, meme_text=None, image_prompt=None, png=None):
+        with self._connection() as conn:
+            cursor = conn.execute(INSERT_MEME, (prompt, meme_text, image_prompt, time.time(), email))
+            if cursor.rowcount == 0:
+                return None
+            meme_id = cursor.lastrowid
+            if png is not None:
+                conn.execute(INSERT_MEME_IMAGE_FILE, (meme_id, self._write_image(meme_id, png)))
+        return meme_id
+
+    # Returns one page of the user's memes, newest first, and the cursor for the next page (None on the last page).
+    # Pass the returned cursor back as before_id to get the following page
+    def get_history(self, email, before_id=None, limit=20):
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        conn = self._connection()
+        # Fetch one extra row to find out whether there is a next page
+        if before_id is None:
+            rows = conn.execute(SELECT_HISTORY_FIRST_PAGE, (email, limit + 1)).fetchall()
+        else:
+            rows = conn.execute(SELECT_HISTORY_PAGE, (email, int(before_id), limit + 1)).fetchall()
+
+        memes = [dict(row) for row in rows[:limit]]
+        next_before_id = memes[-1]["id"] if len(rows) > limit else None
+        return memes, next_before_id
+
+    # Returns the meme's PNG bytes, or None if the meme doesn't exist, doesn't belong to the user or has no image
+    def get_meme_image(self, email, meme_id):
+        row = self._connection().execute(SELECT_MEME_IMAGE, (int(meme_id), email)).fetchone()
+        if row is None:
+            return None
+        if row["path"] is not None:
+            return self._read_image(row["path"])
+        return row["png"]
+
+    # Image files are removed after the rows are deleted, so a failed delete never leaves a meme without its image
+    def delete_meme(self, email, meme_id):
+        with self._connection() as conn:
+            paths = [row["path"] for row in conn.execute(SELECT_MEME_IMAGE_FILE, (int(meme_id), email))]
+            deleted = conn.execute(DELETE_MEME, (int(meme_id), email)).rowcount > 0
+        self._remove_images(paths)
+        return deleted
+
+    def clear_history(self, email):
+        with self._connection() as conn:
+            paths = [row["path"] for row in conn.execute(SELECT_HISTORY_IMAGE_FILES, (email,))]
+            deleted = conn.execute(DELETE_HISTORY, (email,)).rowcount
+        self._remove_images(paths)
+        return deleted
+
+    def count_memes(self, email):
+        return self._connection().execute(COUNT_MEMES, (email,)).fetchone()[0]
+
+    # ------------ PREGENERATION BUDGET ------------
+    # Speculative generations are counted here rather than in each process, so the hourly budget holds across every web process
+
+    # Records one speculative generation if fewer than limit were recorded since the given time. Returns False if the budget is used up
+    def reserve_pregeneration_spend(self, limit, since):
+        with self._connection() as conn:
+            conn.execute(DELETE_OLD_PREGENERATION_SPEND, (since,))
+            return conn.execute(INSERT_PREGENERATION_SPEND, (time.time(), since, int(limit))).rowcount > 0
+
+    def count_pregeneration_spend(self, since):
+        return self._connection().execute(COUNT_PREGENERATION_SPEND, (since,)).fetchone()[0]
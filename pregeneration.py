@@ -0,0 +1,154 @@
+# Pregeneration Pool
+# Keeps a few ready-made memes for the most requested topics, so a matching /generate request is answered instantly instead of waiting on Gemini and the image generator.
+# Topic popularity is seeded from the generation log and kept up to date from live requests. The generic "anything" topic (the default prompt) always has a pool.
+# Memes are only made while the providers are idle, each one is served at most once, stale ones expire, and an hourly budget caps the speculative API spend.
+# With a meme store the budget is counted in its database, so it is shared by every process using the store instead of applying per process.
+
+import re
+import threading
+import time
+from collections import Counter, deque
+
+ANYTHING_TOPIC = "anything"
+
+# Matches the user prompt lines written by write_log_file() in AIMemeGenerator.py
+LOG_PROMPT_PATTERN = re.compile(r"^\s*User Prompt: '(.*)'\s*$")
+
+def normalize_topic(prompt):
+    topic = ' '.join(str(prompt or '').lower().split())
+    return topic or ANYTHING_TOPIC
+
+# Counts how often each topic appears in a log.txt file. A missing log just gives no counts
+def read_topic_counts(log_path):
+    counts = Counter()
+    try:
+        with open(log_path, "r", encoding='utf-8') as log_file:
+            for line in log_file:
+                match = LOG_PROMPT_PATTERN.match(line)
+                if match:
+                    counts[normalize_topic(match.group(1))] += 1
+    except OSError:
+        pass
+    return counts
+
+class PregenerationPool:
+    # generate_one(topic) makes one meme and returns it (or None on failure). is_idle() says whether there is spare provider capacity right now.
+    # store is an optional MemeStore that keeps the budget count. Without one, it is kept in this process
+    def __init__(self, generate_one, is_idle=lambda: True, hot_topics=5, per_topic=2, max_age=3600, budget_per_hour=10, log_path="log.txt", refill_interval=5.0, store=None):
+        self.generate_one = generate_one
+        self.is_idle = is_idle
+        self.store = store
+        self.hot_topics = hot_topics
+        self.per_topic = per_topic
+        self.max_age = max_age
+        self.budget_per_hour = budget_per_hour
+        self.refill_interval = refill_interval
+
+        self._lock = threading.Lock()
+        self._pools = {}
+        self._topic_counts = read_topic_counts(log_path)
+        self._spent = deque()
+        self._stop = threading.Event()
+        self._thread = None
+        self.served = 0
+        self.expired = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._refill_loop, name="pregeneration", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def record_request(self, prompt):
+        with self._lock:
+            self._topic_counts[normalize_topic(prompt)] += 1
+
+    # Returns a ready meme for the prompt and removes it from the pool, or None if there isn't one
+    def take(self, prompt):
+        topic = normalize_topic(prompt)
+        now = time.time()
+        with self._lock:
+            pool = self._pools.get(topic)
+            while pool:
+                created_at, meme = pool.popleft()
+                if now - created_at < self.max_age:
+                    self.served += 1
+                    return meme
+                self.expired += 1
+        return None
+
+    # The topics that get a pool, most requested first. "anything" is always one of them
+    def get_hot_topics(self):
+        with self._lock:
+            topics = [topic for topic, count in self._topic_counts.most_common(self.hot_topics + 1) if topic != ANYTHING_TOPIC]
+        return [ANYTHING_TOPIC] + topics[:self.hot_topics]
+
+    def remaining_budget(self):
+        cutoff = time.time() - 3600
+        if self.store is not None:
+            return self.budget_per_hour - self.store.count_pregeneration_spend(cutoff)
+        with self._lock:
+            while self._spent and self._spent[0] < cutoff:
+                self._spent.popleft()
+            return self.budget_per_hour - len(self._spent)
+
+    # Spends one generation from the hourly budget. Returns False if it is used up
+    def _reserve_budget(self):
+        if self.store is not None:
+            return self.store.reserve_pregeneration_spend(self.budget_per_hour, time.time() - 3600)
+        if self.remaining_budget() <= 0:
+            return False
+        with self._lock:
+            self._spent.append(time.time())
+        return True
+
+    def get_status(self):
+        with self._lock:
+            ready = {topic: len(pool) for topic, pool in self._pools.items() if pool}
+        return {"ready": ready, "served": self.served, "expired": self.expired, "remaining_budget": self.remaining_budget()}
+
+    # Picks the hot topic with the fewest ready memes, or None if every pool is full. Expired memes are dropped on the way
+    def _next_topic_to_fill(self):
+        now = time.time()
+        best_topic, best_count = None, self.per_topic
+        for topic in self.get_hot_topics():
+            with self._lock:
+                pool = self._pools.setdefault(topic, deque())
+                while pool and now - pool[0][0] >= self.max_age:
+                    pool.popleft()
+                    self.expired += 1
+                count = len(pool)
+            if count < best_count:
+                best_topic, best_count = topic, count
+        return best_topic
+
+    # Makes at most one meme. Returns True if it did
+    def refill_once(self):
+        if not self.is_idle() or self.remaining_budget() <= 0:
+            return False
+        topic = self._next_topic_to_fill()
+        if topic is None or not self._reserve_budget():
+            return False
+
+        try:
+            meme = self.generate_one(topic)
+        # generate() calls sys.exit() on errors, which must not end the refill thread
+        except (Exception, SystemExit) as ex:
+            print(f"Pregeneration for '{topic}' failed: {ex}")
+            return False
+        if meme is None:
+            return False
+
+        with self._lock:
+            self._pools.setdefault(topic, deque()).append((time.time(), meme))
+        return True
+
+    def _refill_loop(self):
+        while not self._stop.is_set():
+            if not self.refill_once():
+                self._stop.wait(self.refill_interval)
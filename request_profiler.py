@@ -0,0 +1,93 @@
+# Request Profiler
+# Runs one call under profilers and saves where its time went, for looking into a single slow meme.
+# cProfile records every function call, and is saved as a .pstats file (open with pstats, snakeviz, etc.).
+# At the same time a sampler thread takes the call's Python stack every few milliseconds, including the time spent waiting on providers,
+# and saves the counts as a .collapsed file, one "frame;frame;frame count" line per stack, which flamegraph.pl and speedscope read directly.
+# Nothing here runs unless profiling was asked for, so other calls have no overhead.
+# Only one cProfile can run at a time: on Python 3.12 and later it is built on sys.monitoring, which is process-wide, so a second one fails
+# to start and the one that is running records every thread in the process, not just the profiled call. A call that arrives while another
+# is being profiled gets only the stack sampler, which follows its own thread.
+
+import cProfile
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+# Held while a cProfile is running
+_cprofile_lock = threading.Lock()
+
+def format_frame(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+# The stack of a frame from the outermost call inward, joined the way collapsed-stack files expect
+def collapse_stack(frame):
+    names = []
+    while frame is not None:
+        names.append(format_frame(frame).replace(";", ":"))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+class StackSampler:
+    def __init__(self, thread_id, interval=DEFAULT_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[collapse_stack(frame)] += 1
+
+    def write(self, file_path):
+        with open(file_path, "w", encoding='utf-8') as collapsed_file:
+            for stack, count in self.samples.most_common():
+                collapsed_file.write(f"{stack} {count}\n")
+
+# Calls fn() under the profilers and saves both profiles in the folder as <name>-<time>.pstats and .collapsed.
+# If another call is already being profiled, only the .collapsed file is saved (see above).
+# Returns fn's result and the path the files were saved under, without the extension. The profiles are saved even if fn raises
+def profile_call(fn, name, profiles_folder="Profiles", sample_interval=DEFAULT_SAMPLE_INTERVAL):
+    os.makedirs(profiles_folder, exist_ok=True)
+    safe_name = re.sub(r"[^A-Za-z0-9_-]+", "_", name).strip("_")[:40] or "profile"
+    profile_path = os.path.join(profiles_folder, f"{safe_name}-{time.strftime('%Y-%m-%d-%H-%M-%S')}-{threading.get_ident() % 10000:04d}")
+
+    profiler = cProfile.Profile() if _cprofile_lock.acquire(blocking=False) else None
+    sampler = StackSampler(threading.get_ident(), sample_interval)
+    start = time.perf_counter()
+    try:
+        sampler.start()
+        try:
+            if profiler is not None:
+                profiler.enable()
+            try:
+                result = fn()
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+        finally:
+            sampler.stop()
+            if profiler is not None:
+                profiler.dump_stats(profile_path + ".pstats")
+            sampler.write(profile_path + ".collapsed")
+            saved = "" if profiler is not None else ", stack samples only because another profile was running"
+            print(f"Profile saved to '{profile_path}' ({time.perf_counter() - start:.2f}s, {sum(sampler.samples.values())} samples{saved})")
+    finally:
+        if profiler is not None:
+            _cprofile_lock.release()
+    return result, profile_path
@@ -0,0 +1,35 @@
+# SQLite Database
+# Base class for the SQLite-backed stores (meme_store.py and job_queue.py). Each thread gets its own connection, since connections are not
+# shared across threads or processes, and its statement cache reuses the prepared statements of the store. Every connection runs in WAL mode,
+# so readers never block the writer and several processes can use the same file.
+
+import sqlite3
+import threading
+
+class SQLiteDatabase:
+    # isolation_level=None leaves transactions to the caller. pragmas are run on every new connection, after the WAL ones
+    def __init__(self, db_path, busy_timeout=5.0, isolation_level="", pragmas=()):
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        self._isolation_level = isolation_level
+        self._pragmas = tuple(pragmas)
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, isolation_level=self._isolation_level, cached_statements=64)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for pragma in self._pragmas:
+                conn.execute(pragma)
+            self._local.conn = conn
+        return conn
+
+    # Closes the calling thread's connection. The next call on this thread opens a new one
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
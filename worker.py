@@ -0,0 +1,171 @@
+# Generation Worker
+# Runs meme generation jobs from the job queue (see job_queue.py), so generation capacity can be scaled separately from the web front-ends.
+# Start as many of these as needed, on any machine that can reach the queue and meme databases:   python worker.py
+# Each worker thread claims one job at a time, keeps its lease alive while the meme is generated, saves the meme to the user's history in
+# the meme store, and then marks the job done with the meme's id. If the worker dies, its lease runs out and another worker picks the job up.
+# The queue and meme databases are set with the MEME_QUEUE_PATH and MEME_DB_PATH environment variables, the rest with the [Workers] settings.
+
+import os
+import socket
+import sys
+import threading
+
+from AIMemeGenerator import (build_pipeline, generate_single_meme, get_settings, get_layout_cache_stats, print_image_reuse_stats, NoFontFileError, MissingGeminiKeyError,
+                             MissingAPIKeyError, InvalidImagePlatformError, RateLimitQuotaExceededError, CircuitOpenError)
+from job_queue import SQLiteJobQueue
+from meme_store import MemeStore
+
+# Seconds before a job that failed with a provider error is tried again
+RETRY_DELAY = 5.0
+
+# Errors that retrying the same job can't fix
+PERMANENT_ERRORS = (NoFontFileError, MissingGeminiKeyError, MissingAPIKeyError, InvalidImagePlatformError, RateLimitQuotaExceededError)
+
+def get_job_queue(settings):
+    return SQLiteJobQueue(
+        os.environ.get('MEME_QUEUE_PATH', 'jobs.db'),
+        lease_seconds=float(settings.get('Job_Lease_Seconds', 60)),
+        max_attempts=int(settings.get('Job_Max_Attempts', 3))
+    )
+
+# The pipeline is built once and shared by the worker threads. It is only rebuilt when the settings snapshot changes,
+# so jobs don't re-read the API keys or rebuild the provider clients
+_pipeline = None
+_pipeline_settings = None
+_pipeline_lock = threading.Lock()
+
+def get_pipeline():
+    global _pipeline, _pipeline_settings
+    settings = get_settings(noUserInput=True)
+    if settings is _pipeline_settings and _pipeline is not None:
+        return _pipeline
+    with _pipeline_lock:
+        if settings is not _pipeline_settings or _pipeline is None:
+            try:
+                _pipeline = build_pipeline(noUserInput=True, noFileSave=True)
+            except (Exception, SystemExit) as ex:
+                # main() already built one, so a bad edit keeps the previous pipeline instead of failing every job
+                if _pipeline is None:
+                    raise
+                print(f"\n  ERROR:  Could not apply the new settings, keeping the previous ones. Error: {ex}")
+            _pipeline_settings = settings
+        return _pipeline
+
+# Generates one meme for the prompt with the current settings, and returns its PNG bytes and text
+def generate_job_meme(prompt):
+    pipeline = get_pipeline()
+    memeInfoDict = generate_single_meme(pipeline, prompt)
+    return {
+        'png': memeInfoDict['virtual_meme_file'].getvalue(),
+        'meme_text': memeInfoDict['meme_text'],
+        'image_prompt': memeInfoDict['image_prompt']
+    }
+
+# Extends the lease on a job every third of the lease period until stopped
+class LeaseKeeper:
+    def __init__(self, queue, job_id, worker_id):
+        self.queue = queue
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"lease-{job_id}", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.queue.lease_seconds / 3):
+                if not self.queue.extend_lease(self.job_id, self.worker_id):
+                    self.lost = True
+                    return
+        finally:
+            # Close this thread's queue connection
+            self.queue.close()
+
+def process_job(queue, store, job, worker_id, generate_one=generate_job_meme):
+    payload = job['payload']
+    print(f"\n[{worker_id}] Job {job['id']} (attempt {job['attempts']}): '{payload['prompt']}'")
+    try:
+        with LeaseKeeper(queue, job['id'], worker_id) as lease:
+            meme = generate_one(payload['prompt'])
+    # The provider is paused, so nothing was tried. The job waits for the circuit to close without losing an attempt
+    except CircuitOpenError as cx:
+        queue.defer(job['id'], worker_id, cx, retry_delay=max(cx.retry_in, RETRY_DELAY))
+        return False
+    except PERMANENT_ERRORS as px:
+        queue.fail(job['id'], worker_id, px, retry_delay=None)
+        return False
+    # SystemExit too, so a sys.exit() deep in the pipeline fails the job instead of ending the thread with the job still leased
+    except (Exception, SystemExit) as ex:
+        print(f"[{worker_id}] Job {job['id']} failed: {ex}")
+        queue.fail(job['id'], worker_id, ex, retry_delay=RETRY_DELAY)
+        return False
+
+    # If the lease ran out meanwhile, the job belongs to another worker now and this result is dropped
+    if lease.lost or not queue.extend_lease(job['id'], worker_id):
+        print(f"[{worker_id}] Lost the lease on job {job['id']}, dropping its result.")
+        return False
+
+    meme_id = store.add_meme(payload['user'], payload['prompt'], meme['meme_text'], meme['image_prompt'], meme['png'])
+    if meme_id is None:
+        queue.fail(job['id'], worker_id, f"User '{payload['user']}' not found", retry_delay=None)
+        return False
+    return queue.complete(job['id'], worker_id, {'meme_id': meme_id, 'meme_text': meme['meme_text'], 'image_prompt': meme['image_prompt']})
+
+# Claims and runs jobs until stop_event is set. Waits poll_interval seconds between checks while the queue is empty
+def run_worker(queue, store, worker_id, stop_event, generate_one=generate_job_meme, poll_interval=0.5):
+    while not stop_event.is_set():
+        job = queue.claim(worker_id)
+        if job is None:
+            stop_event.wait(poll_interval)
+            continue
+        process_job(queue, store, job, worker_id, generate_one)
+
+def main():
+    # Missing keys or fonts stop the worker here, before it claims any job. get_api_keys() would wait for input if the keys file is missing
+    if not os.path.isfile('api_keys.ini'):
+        print("\n  ERROR:  'api_keys.ini' not found. Run AIMemeGenerator.py once to create it, then add your API keys.")
+        sys.exit(1)
+    try:
+        get_pipeline()
+    except (NoFontFileError, MissingGeminiKeyError, MissingAPIKeyError, InvalidImagePlatformError) as ex:
+        print(f"\n  ERROR:  {ex}")
+        sys.exit(1)
+
+    settings = get_settings(noUserInput=True)
+    queue = get_job_queue(settings)
+    store = MemeStore(os.environ.get('MEME_DB_PATH', 'memes.db'))
+    worker_threads = int(settings.get('Worker_Threads', 2))
+    poll_interval = float(settings.get('Worker_Poll_Seconds', 0.5))
+
+    stop_event = threading.Event()
+    threads = []
+    for number in range(worker_threads):
+        worker_id = f"{socket.gethostname()}-{os.getpid()}-{number}"
+        thread = threading.Thread(target=run_worker, args=(queue, store, worker_id, stop_event), kwargs={'poll_interval': poll_interval}, name=worker_id)
+        thread.start()
+        threads.append(thread)
+    print(f"Worker started with {worker_threads} threads. Press Ctrl+C to stop after the current jobs.")
+
+    try:
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=1.0)
+    except KeyboardInterrupt:
+        print("\nStopping...")
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+    layout_stats = get_layout_cache_stats()
+    print(f"Caption layout cache: {layout_stats['hits']} hits, {layout_stats['misses']} misses ({layout_stats['hit_rate']:.0%} hit rate)")
+    print_image_reuse_stats()
+
+if __name__ == "__main__":
+    main()